@@ -0,0 +1,157 @@
+import json
+import mmap
+import os
+import sys
+import zipfile
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+# Separates a corpus path from a page in the "Filepath" of a source
+SEPARATOR = "::"
+# Suffix of the index of a packed corpus
+INDEX_SUFFIX = ".index.json"
+
+
+class ZipCorpus:
+    """Pages read straight from a zip of the sources"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        self.members = {
+            info.filename: info for info in self.zip.infolist() if not info.is_dir()
+        }
+
+    def entries(self) -> list[dict]:
+        """Name, size and modification time of the pages"""
+        return [
+            {
+                "member": member,
+                "size": info.file_size,
+                "mtime": zipfile_mtime(info),
+            }
+            for member, info in self.members.items()
+        ]
+
+    def read(self, member: str) -> str:
+        return self.zip.read(member).decode("utf-8")
+
+    def iter_pages(self):
+        """Yield (member, source) pairs in archive order"""
+        for member in self.members:
+            yield member, self.read(member)
+
+
+class PackedCorpus:
+    """
+    Pages packed in a single file by `pack_corpus`, with an index of their
+    (offset, length) in the pack. Random reads go through a memory map, full
+    passes stream the pack sequentially.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path + INDEX_SUFFIX, "r") as f:
+            # member -> {"offset", "length", "mtime"}
+            self.members: dict[str, dict] = json.load(f)
+
+        self.file = open(path, "rb")
+        # An empty file cannot be mapped
+        if os.fstat(self.file.fileno()).st_size:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.map = b""
+
+    def entries(self) -> list[dict]:
+        return [
+            {"member": member, "size": entry["length"], "mtime": entry["mtime"]}
+            for member, entry in self.members.items()
+        ]
+
+    def read(self, member: str) -> str:
+        entry = self.members[member]
+        return self.map[entry["offset"] : entry["offset"] + entry["length"]].decode(
+            "utf-8"
+        )
+
+    def iter_pages(self):
+        """Yield (member, source) pairs in pack order, reading it sequentially"""
+        members = sorted(self.members.items(), key=lambda item: item[1]["offset"])
+        with open(self.path, "rb") as f:
+            for member, entry in members:
+                f.seek(entry["offset"])
+                yield member, f.read(entry["length"]).decode("utf-8")
+
+
+def zipfile_mtime(info: zipfile.ZipInfo) -> float:
+    return datetime(*info.date_time).timestamp()
+
+
+def is_corpus(path: str) -> bool:
+    """Whether `path` is a zip or a packed corpus rather than a folder"""
+    return os.path.isfile(path) and (
+        zipfile.is_zipfile(path) or os.path.exists(path + INDEX_SUFFIX)
+    )
+
+
+@lru_cache(maxsize=None)
+def _open_corpus(path: str, pid: int):
+    if zipfile.is_zipfile(path):
+        return ZipCorpus(path)
+    return PackedCorpus(path)
+
+
+def open_corpus(path: str) -> ZipCorpus | PackedCorpus:
+    """Open a corpus once per process (file offsets are not shared with forks)"""
+    return _open_corpus(path, os.getpid())
+
+
+def corpus_filepath(path: str, member: str) -> str:
+    return f"{path}{SEPARATOR}{member}"
+
+
+def split_filepath(filepath: str) -> tuple[str, str] | None:
+    """(corpus path, member) of a page of a corpus, None for a plain file"""
+    if SEPARATOR not in filepath:
+        return None
+    path, member = filepath.split(SEPARATOR, 1)
+    return path, member
+
+
+def pack_corpus(source: str, output: str):
+    """
+    Pack the `.txt` pages of a folder or a zip in a single file, with its
+    (offset, length) index in `output` + `INDEX_SUFFIX`.
+    """
+    if is_corpus(source):
+        corpus = open_corpus(source)
+        pages = (
+            (Path(entry["member"]).name, entry["mtime"], corpus.read(entry["member"]))
+            for entry in corpus.entries()
+        )
+    else:
+        pages = (
+            (f.name, f.stat().st_mtime, f.read_text())
+            for f in Path(source).iterdir()
+            if f.is_file()
+        )
+
+    index = {}
+    offset = 0
+    with open(output, "wb") as f:
+        for name, mtime, text in pages:
+            if not name.lower().endswith(".txt"):
+                continue
+            data = text.encode("utf-8")
+            f.write(data)
+            index[name] = {"offset": offset, "length": len(data), "mtime": mtime}
+            offset += len(data)
+
+    with open(output + INDEX_SUFFIX, "w") as f:
+        json.dump(index, f)
+
+
+if __name__ == "__main__":
+    # python -m stardewkg.corpus <sources folder or zip> <pack file>
+    pack_corpus(sys.argv[1], sys.argv[2])
@@ -0,0 +1,205 @@
+import re
+
+import mwparserfromhell
+from mwparserfromhell.nodes import Argument, HTMLEntity, Tag, Template, Text
+from mwparserfromhell.wikicode import Wikicode
+
+from stardewkg.wikitable import wikicode_text
+
+# Templates rendered by `template_text`: "{{Name|Milk|1}}" -> "Milk (1)",
+# "{{Season|Spring}}" -> "Spring", "{{Price|350}}" -> "350"... Values using
+# other templates are left to the LLM.
+TEMPLATE_FAMILIES = {
+    "!",
+    "name",
+    "season",
+    "npc",
+    "price",
+    "description",
+    "cookingchannel",
+    "nowrap",
+}
+# Templates making one item each when a value only holds them, like the
+# ingredients "{{Name|Fried Egg|1}}{{Name|Milk|1}}"
+ITEM_TEMPLATES = {"name", "season", "npc"}
+# Params holding a list of entities, which are also separated by commas:
+# "[[The Beach|Ocean]], [[Ginger Island]]" (commas inside parentheses are
+# kept, like "Spring (Forest, Beach)")
+LIST_PARAMS = {
+    "location",
+    "season",
+    "ingredients",
+    "tingredients",
+    "buff",
+    "stats",
+    "produce",
+    "produces",
+}
+# Separators of the items of any value ("&bull;"), besides "<br>", "{{!}}" and
+# new lines
+BULLETS = {"•"}
+# Tags dropped from the values
+DROPPED_TAGS = {"ref"}
+# Tags the rules do not render
+UNRESOLVED_TAGS = {"table", "gallery"}
+
+BOOLEANS = {"true": True, "yes": True, "false": False, "no": False}
+INTEGER = re.compile(r"^-?(?:[1-9]\d{0,2}(?:,\d{3})+|[1-9]\d*|0)$")
+FLOAT = re.compile(r"^-?\d+\.\d+$")
+
+
+def template_family(template: Template) -> str:
+    return str(template.name).strip().lower()
+
+
+def is_resolved(value: Wikicode) -> bool:
+    """Whether the rules can render every node of a param value"""
+    for node in value.ifilter(recursive=True):
+        if isinstance(node, Argument):
+            return False
+        if isinstance(node, Template) and template_family(node) not in TEMPLATE_FAMILIES:
+            return False
+        if isinstance(node, Tag) and str(node.tag).lower() in UNRESOLVED_TAGS:
+            return False
+    return True
+
+
+def is_separator(node) -> bool:
+    if isinstance(node, Tag):
+        return str(node.tag).lower() == "br"
+    if isinstance(node, HTMLEntity):
+        return node.normalize() in BULLETS
+    return isinstance(node, Template) and template_family(node) == "!"
+
+
+def split_text(text: str, depth: int, commas: bool) -> tuple[list[str], int]:
+    """
+    Parts of a text separated by bullets (and commas with `commas`) outside
+    of parentheses, and the parenthesis depth at its end, starting at `depth`.
+    """
+    parts = [""]
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(0, depth - 1)
+        if char in BULLETS or (commas and char == "," and not depth):
+            parts.append("")
+        else:
+            parts[-1] += char
+    return parts, depth
+
+
+def split_items(value: Wikicode, list_param: bool = False) -> list[list]:
+    """
+    Nodes of the items of a value, separated by "<br>", "{{!}}", bullets or
+    new lines (and commas for a `list_param`), a run of item templates
+    making one item per template.
+    """
+    items = [[]]
+    depth = 0
+    for node in value.nodes:
+        if is_separator(node):
+            items.append([])
+        elif isinstance(node, Text):
+            lines = node.value.split("\n")
+            for i, line in enumerate(lines):
+                if i:
+                    items.append([])
+                    line = line.lstrip("*# ")
+                parts, depth = split_text(line, depth, list_param)
+                items[-1].append(Text(parts[0]))
+                items.extend([Text(part)] for part in parts[1:])
+        else:
+            items[-1].append(node)
+
+    exploded = []
+    for nodes in items:
+        content = [
+            node
+            for node in nodes
+            if not (isinstance(node, Text) and not node.value.strip())
+        ]
+        if len(content) > 1 and all(
+            isinstance(node, Template) and template_family(node) in ITEM_TEMPLATES
+            for node in content
+        ):
+            exploded.extend([node] for node in content)
+        else:
+            exploded.append(nodes)
+    return exploded
+
+
+def convert_scalar(text: str):
+    """Numbers and booleans of a value, like the LLM answers"""
+    if INTEGER.match(text):
+        return int(text.replace(",", ""))
+    if FLOAT.match(text):
+        return float(text)
+    return BOOLEANS.get(text.lower(), text)
+
+
+def convert_value(value: Wikicode, list_param: bool = False):
+    """Scalar of a value, or the list of its items, see `split_items`"""
+    # Items name the linked pages, like the LLM answers
+    texts = [
+        wikicode_text(Wikicode(nodes), link_targets=True)
+        for nodes in split_items(value, list_param)
+    ]
+    values = [convert_scalar(text) for text in texts if text]
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+def convert_infobox(infobox: str) -> tuple[dict | None, list[str]]:
+    """
+    Convert an infobox to the JSON data of the LLM prompt, with rules.
+
+    Returns:
+        The data (None without infobox) and the names of the params the
+        rules could not resolve. Their data is a best effort (missing when
+        it renders empty), to be replaced by the LLM answer (see
+        `merge_answer`).
+    """
+    wikicode = mwparserfromhell.parse(infobox or "", skip_style_tags=True)
+    # The outermost template, possibly inside <onlyinclude>
+    templates = wikicode.filter_templates(recursive=True)
+    if not templates:
+        return None, []
+
+    for tag in wikicode.filter_tags(
+        matches=lambda node: str(node.tag).lower() in DROPPED_TAGS
+    ):
+        try:
+            wikicode.remove(tag)
+        except ValueError:
+            # Inside a dropped tag already
+            pass
+
+    data = {}
+    unresolved = []
+    for param in templates[0].params:
+        if not param.showkey:
+            continue
+        name = str(param.name).strip()
+        # Checked first, a value only holding an unknown template renders empty
+        if not is_resolved(param.value):
+            unresolved.append(name)
+        value = convert_value(param.value, name.lower() in LIST_PARAMS)
+        if value is not None:
+            data[name] = value
+    return data, unresolved
+
+
+def merge_answer(data: dict | None, unresolved: list[str], answer) -> dict | None:
+    """Data of the rules, with the unresolved params taken from the LLM answer"""
+    if data is None or not isinstance(answer, dict):
+        return data
+    data = dict(data)
+    for name in unresolved:
+        if name in answer:
+            data[name] = answer[name]
+    return data
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+# Default of `LLMCache.get` telling a missing answer from a cached None
+MISSING = object()
+
+
+def prompt_version(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Append-only cache of the LLM answers, in a sqlite file.
+
+    Answers are keyed by a hash of the model, the system prompt, the input
+    text and the options, and committed one at a time, so a run can be
+    interrupted at any point and resumed. Each answer also records its task
+    ("infobox", "bundles", ...) and the version of the task prompt:
+    `use_prompt` drops the answers of the other versions once the prompt
+    changes.
+
+    Answers exported by earlier runs, whose keys need the input texts, can
+    be stored by name with the model which gave them (`put_exported`), and
+    looked up one at a time (`get_exported`) once the texts are known. The
+    export files do not hold the input texts: an exported answer is bound
+    to the digest of the first text it is looked up or bound
+    (`bind_exported`) with, and only given for this text and model.
+
+    The connection is shared by the conversion threads.
+
+    Usage:
+        with LLMCache("./data/llm_cache.sqlite") as cache:
+            infoboxes_to_json(infoboxes, save_path, cache=cache)
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        folder = os.path.dirname(filepath)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS answers "
+            "(key TEXT PRIMARY KEY, task TEXT, version TEXT, answer TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS prompts (task TEXT PRIMARY KEY, version TEXT)"
+        )
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(exported)")
+        ]
+        if columns and "digest" not in columns:
+            # Exported answers of an older cache, without model nor text digest,
+            # imported again
+            self.connection.execute("DROP TABLE exported")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS exported "
+            "(task TEXT, version TEXT, model TEXT, name TEXT, digest TEXT, answer TEXT, "
+            "PRIMARY KEY (task, name))"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def key(model: str, system_prompt: str, text: str, options: dict) -> str:
+        h = hashlib.sha256()
+        for part in [model, system_prompt, text, json.dumps(options, sort_keys=True)]:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key: str, default=None):
+        """Cached answer (any JSON value), `default` if missing"""
+        return self.get_first([key], default)
+
+    def get_first(self, keys: list[str], default=None):
+        """Cached answer of the first of `keys` in the cache, `default` if none"""
+        with self.lock:
+            for key in keys:
+                row = self.connection.execute(
+                    "SELECT answer FROM answers WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    return json.loads(row[0])
+            self.misses += 1
+        return default
+
+    def put(self, key: str, task: str, system_prompt: str, answer):
+        self.put_many(task, system_prompt, [(key, answer)])
+
+    def put_many(self, task: str, system_prompt: str, items):
+        """Store (key, answer) pairs of `task`"""
+        version = prompt_version(system_prompt)
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)",
+                (
+                    (key, task, version, json.dumps(answer))
+                    for key, answer in items
+                ),
+            )
+            self.connection.commit()
+
+    def put_exported(self, task: str, system_prompt: str, model: str, items):
+        """Store (name, answer) pairs exported by `task`, answered by `model`"""
+        version = prompt_version(system_prompt)
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO exported VALUES (?, ?, ?, ?, NULL, ?)",
+                (
+                    (task, version, model, name, json.dumps(answer))
+                    for name, answer in items
+                ),
+            )
+            self.connection.commit()
+
+    def bind_exported(self, task: str, items):
+        """Bind the unbound exported answers of the (name, text) pairs to their text"""
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE exported SET digest = ? "
+                "WHERE task = ? AND name = ? AND digest IS NULL",
+                ((text_digest(text), task, name) for name, text in items),
+            )
+            self.connection.commit()
+
+    def get_exported(self, task: str, name: str, model: str, text: str, default=None):
+        """
+        Exported answer of `name`, `default` if missing or given by another
+        model or for another text than `text`
+        """
+        digest = text_digest(text)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT model, digest, answer FROM exported WHERE task = ? AND name = ?",
+                (task, name),
+            ).fetchone()
+            if row is not None and row[1] is None:
+                self.connection.execute(
+                    "UPDATE exported SET digest = ? WHERE task = ? AND name = ?",
+                    (digest, task, name),
+                )
+                self.connection.commit()
+                row = (row[0], digest, row[2])
+        if row is None or row[0] != model or row[1] != digest:
+            return default
+        return json.loads(row[2])
+
+    def has_exported(self, task: str) -> bool:
+        """Whether answers exported by `task` are stored"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM exported WHERE task = ? LIMIT 1", (task,)
+            ).fetchone()
+        return row is not None
+
+    def use_prompt(self, task: str, system_prompt: str) -> bool:
+        """
+        Record the prompt version of `task` and drop the answers given to its
+        other versions.
+
+        Returns:
+            Whether the cache never saw `task` before
+        """
+        version = prompt_version(system_prompt)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT version FROM prompts WHERE task = ?", (task,)
+            ).fetchone()
+            evicted = self.connection.execute(
+                "DELETE FROM answers WHERE task = ? AND version != ?", (task, version)
+            ).rowcount
+            self.connection.execute(
+                "DELETE FROM exported WHERE task = ? AND version != ?", (task, version)
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO prompts VALUES (?, ?)", (task, version)
+            )
+            self.connection.commit()
+        if evicted:
+            logging.info(f"Evicted {evicted} {task} answers of obsolete prompts")
+        return row is None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        self.connection.close()
+
+
+def open_llm_cache() -> LLMCache:
+    return LLMCache(os.getenv("LLM_CACHE", "./data/llm_cache.sqlite"))
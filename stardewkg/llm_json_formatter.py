@@ -1,37 +1,81 @@
 import os
+import re
 import json
-import joblib
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
 from tqdm import tqdm
 import ollama
 import logging
+from stardewkg.infobox_converter import convert_infobox, merge_answer
+from stardewkg.llm_cache import MISSING, LLMCache, open_llm_cache
 
 
-def query_ollama(text, system_prompt, model="qwen2.5-coder:3b", temperature=0.0):
+@lru_cache(maxsize=None)
+def get_client(host: str = None, timeout: float = None) -> ollama.Client:
+    """
+    Ollama client shared by the conversion threads. The server is OLLAMA_HOST
+    by default (a local stub server works too), requests time out after
+    LLM_TIMEOUT seconds.
+    """
+    if timeout is None:
+        timeout = float(os.getenv("LLM_TIMEOUT", 120))
+    return ollama.Client(host=host, timeout=timeout)
+
+
+def query_ollama(text, system_prompt, model="qwen2.5-coder:3b", temperature=0.0, host=None, timeout=None):
     messages = [
          {"role": "system", "content": system_prompt},
           {"role": "user", "content": text}
          ]
-    response = ollama.chat(model=model, messages=messages, options={
+    response = get_client(host, timeout).chat(model=model, messages=messages, options={
         "temperature": temperature})
     response_text = response.get("message", {}).get("content", "")
     
     return response_text
 
 
-def infoboxes_to_json(infoboxes: list[str], save_path: str, model="qwen2.5-coder:3b", ** kwargs):
+def query_with_retries(text, system_prompt, model="qwen2.5-coder:3b", attempts=5, **kwargs):
+    """Answer of the LLM, None if all the attempts failed (or timed out)"""
+    for attempt in range(attempts):
+        try:
+            return query_ollama(text, system_prompt, model=model, **kwargs)
+        except Exception as e:
+            logging.warning(f"LLM query failed (attempt {attempt + 1}/{attempts}): {e}")
+    return None
+
+
+def map_concurrently(func, items, concurrency: int = None):
     """
-    Convert a list of infoboxes to json with a caching mechanism
-    kwargs are passed to ollama.chat option
+    Yield `func(item)` for each item, in order, with up to `concurrency`
+    calls in flight (LLM_CONCURRENCY by default).
+
+    A few more calls than the in-flight limit are queued, so a slow answer at
+    the head does not leave the workers idle; results wait in the queue until
+    the ones before them are collected.
     """
-    
-    # Skip if already processed
-    if os.path.exists(save_path):
-        logging.info("Data has already been processed by LLM, loading it")
-        with open(save_path, "r") as f:
-            processed = json.load(f)
-        return processed
-    
-    system_prompt = """
+    if concurrency is None:
+        concurrency = int(os.getenv("LLM_CONCURRENCY", 4))
+    if concurrency <= 1:
+        yield from map(func, items)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+INFOBOX_SYSTEM_PROMPT = """
     Convert the following MediaWiki infobox text to a JSON format.
     Follow these rules:
     - Remove all MediaWiki template markers ({{, }})
@@ -73,49 +117,345 @@ def infoboxes_to_json(infoboxes: list[str], save_path: str, model="qwen2.5-coder
     }
     """
 
-    # Load cache if it exists
-    cache_file = save_path.replace(".json", ".joblib")
-    if os.path.exists(cache_file):
-        logging.info("Found partially computed json")
-        processed = joblib.load(cache_file)
+
+def llm_options(kwargs: dict) -> dict:
+    """Options of `query_ollama` changing the answers, part of the cache key"""
+    return {"temperature": kwargs.get("temperature", 0.0)}
+
+
+def llm_cache_context(cache: LLMCache = None):
+    """`cache`, or the cache at LLM_CACHE opened for the duration of a call"""
+    return nullcontext(cache) if cache is not None else open_llm_cache()
+
+
+def import_answers(cache: LLMCache, task: str, system_prompt: str, save_path: str, keys: list[tuple]):
+    """
+    Import the answers exported to `save_path` by an earlier run (values in
+    the order of `keys`, or by name when it is a dict) when the cache never
+    saw `task`, so the JSON files shipped with the data convert offline.
+    Once the task is known, its answers only come from the cache.
+    Missing answers (None) are not imported, they are converted again.
+    """
+    if not cache.use_prompt(task, system_prompt) or not os.path.exists(save_path):
+        return
+    with open(save_path, "r") as f:
+        exported = json.load(f)
+    if isinstance(exported, dict):
+        items = [(key, exported.get(name)) for name, key in keys]
     else:
-        processed = {}
+        items = list(zip([key for _, key in keys], exported))
+    items = [(key, answer) for key, answer in items if answer is not None]
+    logging.info(f"Importing {len(items)} {task} answers from {save_path}")
+    cache.put_many(task, system_prompt, items)
+
+
+def exported_model(save_path: str) -> str:
+    """Model of an export file: qwen2.5-coder:3b for infoboxes_qwen2.5-coder:3b.json"""
+    return os.path.splitext(os.path.basename(save_path))[0].split("_", 1)[-1]
+
+
+def import_exported(cache: LLMCache, task: str, system_prompt: str, save_path: str):
+    """
+    Store the answers exported by name to `save_path` by an earlier run in
+    `cache` (see `LLMCache.put_exported`) unless it already holds answers
+    exported by `task`, so the JSON files shipped with the data convert
+    offline, whichever pages need the LLM. They are only used for the model
+    of the file name and the texts they are bound to. Missing answers (None)
+    are not imported, they are converted again.
+    """
+    if cache.has_exported(task) or not os.path.exists(save_path):
+        return
+    with open(save_path, "r") as f:
+        exported = json.load(f)
+    logging.info(f"Importing {len(exported)} exported {task} answers from {save_path}")
+    cache.put_exported(
+        task,
+        system_prompt,
+        exported_model(save_path),
+        ((name, answer) for name, answer in exported.items() if answer is not None),
+    )
+
+
+BATCH_SYSTEM_PROMPT = INFOBOX_SYSTEM_PROMPT + """
+    You will be given several infoboxes, each one after a line "### <page name>".
+    Convert each of them with the rules above, and answer ONLY one JSON object
+    mapping each page name to the JSON of its infobox:
+    {"<page name>": {...}, "<page name>": {...}}
+    """
+
+# Task of the infobox answers by the prompt giving them, in order of
+# preference. Answers split from a batch are cached under the batch prompt,
+# so they are evicted when it changes.
+INFOBOX_TASKS = {INFOBOX_SYSTEM_PROMPT: "infobox", BATCH_SYSTEM_PROMPT: "infobox_batch"}
+
+
+def infobox_keys(model: str, infobox: str, options: dict) -> list[str]:
+    """Cache keys of the answers to an infobox, see `INFOBOX_TASKS`"""
+    return [LLMCache.key(model, system_prompt, infobox, options) for system_prompt in INFOBOX_TASKS]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough number of tokens of a text, about 4 characters per token"""
+    return len(text) // 4 + 1
+
+
+def pack_batches(items: list[tuple], batch_tokens: int) -> list[list[tuple]]:
+    """Pack (name, infobox) items in batches of up to `batch_tokens` tokens"""
+    batches = []
+    batch = []
+    tokens = 0
+    for item in items:
+        item_tokens = estimate_tokens(item[0]) + estimate_tokens(item[1])
+        if batch and tokens + item_tokens > batch_tokens:
+            batches.append(batch)
+            batch = []
+            tokens = 0
+        batch.append(item)
+        tokens += item_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def batch_text(batch: list[tuple]) -> str:
+    return "\n\n".join(f"### {name}\n{infobox}" for name, infobox in batch)
+
+
+def split_batch_answer(answer: str, names: list[str]) -> dict:
+    """JSON data of the items of a batch answer, only the valid ones"""
+    answer = parse_json_answer(answer)
+    if not isinstance(answer, dict):
+        return {}
+    return {name: answer[name] for name in names if isinstance(answer.get(name), dict)}
+
+
+def convert_infoboxes(items: list[tuple], model="qwen2.5-coder:3b", concurrency: int = None, batch_tokens: int = None, **kwargs):
+    """
+    Yield the (name, system prompt, answer) of (name, infobox) items.
+
+    With `batch_tokens` (LLM_BATCH_TOKENS by default, 0 to disable), the
+    infoboxes are packed in requests of up to `batch_tokens` tokens, tagged
+    by page name, so the long system prompt is processed once per batch.
+    Items missing or invalid in the answer of their batch are converted
+    again one by one.
+    """
+    if batch_tokens is None:
+        batch_tokens = int(os.getenv("LLM_BATCH_TOKENS", 0))
+
+    def convert(item):
+        name, infobox = item
+        return name, INFOBOX_SYSTEM_PROMPT, query_with_retries(infobox, INFOBOX_SYSTEM_PROMPT, model=model, **kwargs)
+
+    if not batch_tokens:
+        yield from map_concurrently(convert, items, concurrency)
+        return
+
+    def convert_batch(batch):
+        answer = query_with_retries(batch_text(batch), BATCH_SYSTEM_PROMPT, model=model, **kwargs)
+        return batch, split_batch_answer(answer, [name for name, _ in batch])
+
+    batches = pack_batches(items, batch_tokens)
+    failed = []
+    for batch, values in map_concurrently(convert_batch, batches, concurrency):
+        for item in batch:
+            if item[0] in values:
+                yield item[0], BATCH_SYSTEM_PROMPT, values[item[0]]
+            else:
+                failed.append(item)
+
+    if failed:
+        logging.info(f"Converting {len(failed)} infoboxes of failed batches one by one")
+    yield from map_concurrently(convert, failed, concurrency)
 
-    # Loop over all infoboxes with a retry mechanism
-    try:
-        for (name, infobox) in tqdm(infoboxes, desc="Processing infoboxes"):
-            # If already processed, skip it
-            if name in processed:
-                continue
-            
-            for attempt in range(5):
-                try:
-                    result = query_ollama(infobox, system_prompt, model=model, **kwargs)
-                    break
-                except:
-                    pass
-            processed[name] = result
-
-            # Save progress after each successful parse
-            joblib.dump(processed, cache_file)
-    except KeyboardInterrupt:
-        print("\nProcessing interrupted by user. Progress saved to cache.")
-        joblib.dump(processed, cache_file)
-        exit()
+
+INFOBOX_TYPE = re.compile(r"Infobox[ _]*(\w*)", re.IGNORECASE)
+INFOBOX_PARAM = re.compile(r"^\s*\|\s*([^=|\n]+?)\s*=", re.MULTILINE)
+
+
+def is_trivial(infobox: str | None) -> bool:
+    """Missing infobox ("None" for the pages without one) or without params"""
+    return not infobox or infobox.strip() == "None" or "=" not in infobox
+
+
+def infobox_signature(infobox: str) -> tuple:
+    """(infobox type, param names) of an infobox text"""
+    match = INFOBOX_TYPE.search(infobox)
+    infobox_type = match.group(1).lower() if match else ""
+    return infobox_type, tuple(sorted(set(INFOBOX_PARAM.findall(infobox))))
+
+
+def prepare_infoboxes(infoboxes: list[tuple[str, str]]) -> tuple[list[tuple[str, str]], dict]:
+    """
+    Pre-conversion stage of `infoboxes_to_json`: drop the trivial
+    infoboxes, keep one page per identical infobox text and group the pages
+    by infobox type and param signature, so that batches hold infoboxes of
+    the same shape.
+
+    Returns:
+        The (name, infobox) of the unique infoboxes, grouped, and the
+        representative page of each page name (None for the trivial ones),
+        to fan the results back out.
+    """
+    representatives = {}
+    unique = {}
+    for name, infobox in infoboxes:
+        if is_trivial(infobox):
+            representatives[name] = None
+            continue
+        digest = hashlib.sha256(infobox.strip().encode("utf-8")).hexdigest()
+        representative = unique.setdefault(digest, (name, infobox))[0]
+        representatives[name] = representative
+
+    groups = {}
+    for name, infobox in unique.values():
+        groups.setdefault(infobox_signature(infobox), []).append((name, infobox))
+
+    trivial = sum(representative is None for representative in representatives.values())
+    logging.info(
+        f"{len(infoboxes)} infoboxes: {trivial} trivial, "
+        f"{len(infoboxes) - trivial - len(unique)} duplicates, "
+        f"{len(unique)} unique in {len(groups)} groups"
+    )
+    # Groups of the same infobox type next to each other
+    grouped = [item for _, group in sorted(groups.items()) for item in group]
+    return grouped, representatives
+
+
+def convert_with_rules(infobox: str, rules: bool = True) -> tuple[dict | None, list[str] | None]:
+    """
+    Data of an infobox converted by `convert_infobox` and its unresolved
+    params, None for all the params when the infobox has to go to the LLM.
+    """
+    if not rules:
+        return None, None
+    data, unresolved = convert_infobox(infobox)
+    return data, unresolved or []
+
+
+def infoboxes_to_json(infoboxes: list[str], save_path: str, model="qwen2.5-coder:3b", concurrency: int = None, cache: LLMCache = None, rules: bool = True, batch_tokens: int = None, export_path: str = None, ** kwargs):
+    """
+    Convert a list of infoboxes to json with a caching mechanism
+    Trivial and duplicate infoboxes are dropped first, see
+    `prepare_infoboxes`.
+    With `rules`, infoboxes are converted by `convert_infobox`: only those
+    with unresolved params go to the LLM, for these params.
+    Answers are cached by model, prompt, infobox and options in `cache`
+    (see `LLMCache`), batch answers under the batch prompt (see
+    `INFOBOX_TASKS`). The answers exported to `save_path` by an earlier run
+    are imported by name (see `import_exported`), bound to the current
+    infoboxes, and used for the infoboxes missing from the cache when
+    `model` gave them, the result is only exported to
+    `export_path` when given, so the files shipped with the data are left
+    as is.
+    Up to `concurrency` requests are sent at the same time, see
+    `map_concurrently`, each with up to `batch_tokens` of infoboxes, see
+    `convert_infoboxes`
+    kwargs are passed to ollama.chat option
+    """
+    task = "infobox"
+    system_prompt = INFOBOX_SYSTEM_PROMPT
+    options = llm_options(kwargs)
+
+    # Texts the exported answers are bound to, see `LLMCache.get_exported`
+    page_infoboxes = [(name, infobox) for name, infobox in infoboxes if not is_trivial(infobox)]
+
+    # Only convert the unique non trivial infoboxes
+    infoboxes, representatives = prepare_infoboxes(infoboxes)
+
+    converted = {name: convert_with_rules(infobox, rules) for (name, infobox) in infoboxes}
+    if rules:
+        logging.info(f"Converted {sum(not unresolved for _, unresolved in converted.values())} of {len(infoboxes)} infoboxes with rules")
+    # Pages still needing the LLM
+    infoboxes = [
+        (name, infobox)
+        for (name, infobox) in infoboxes
+        if converted[name][1] is None or converted[name][1]
+    ]
+    keys = [
+        (name, infobox_keys(model, infobox, options))
+        for (name, infobox) in infoboxes
+    ]
+
+    escalated = {name for name, _ in keys}
+    saved = sum(
+        (representative is None and not rules)
+        or (representative in escalated and representative != name)
+        for name, representative in representatives.items()
+    )
+    logging.info(f"Pre-conversion stage saved {saved} LLM calls")
+
+    with llm_cache_context(cache) as cache:
+        cache.use_prompt(task, system_prompt)
+        cache.use_prompt(INFOBOX_TASKS[BATCH_SYSTEM_PROMPT], BATCH_SYSTEM_PROMPT)
+        import_exported(cache, task, system_prompt, save_path)
+        cache.bind_exported(task, page_infoboxes)
+
+        # If already processed, skip it
+        answers = {}
+        todo = []
+        for (name, name_keys), (_, infobox) in zip(keys, infoboxes):
+            answer = cache.get_first(name_keys, MISSING)
+            if answer is MISSING:
+                # The exported answers were given to single infoboxes
+                answer = cache.get_exported(task, name, model, infobox)
+            if answer is MISSING or answer is None:
+                todo.append((name, infobox))
+            else:
+                answers[name] = answer
+        if todo:
+            logging.info(f"Converting {len(todo)} of {len(infoboxes)} infoboxes with {model}")
+
+        # Loop over all infoboxes with a retry mechanism
+        try:
+            results = convert_infoboxes(todo, model, concurrency, batch_tokens, **kwargs)
+            infobox_texts = dict(todo)
+            for name, prompt, result in tqdm(results, total=len(todo), desc="Processing infoboxes"):
+                answers[name] = result
+                # Failed conversions are not cached, they are retried by the next run
+                if result is not None:
+                    key = LLMCache.key(model, prompt, infobox_texts[name], options)
+                    cache.put(key, INFOBOX_TASKS[prompt], prompt, result)
+        except KeyboardInterrupt:
+            # Cancel the queued requests
+            results.close()
+            print("\nProcessing interrupted by user. Progress saved to cache.")
+            exit()
+
+        logging.info(f"LLM cache statistics: {cache.stats()}")
+
+    processed = {name: data for name, (data, _) in converted.items()}
+    for name, _ in keys:
+        data, unresolved = converted[name]
+        answer = parse_json_answer(answers.get(name))
+        processed[name] = answer if unresolved is None else merge_answer(data, unresolved, answer)
+
+    # Fan the results out to the pages sharing them
+    processed = {
+        name: processed[representative] if representative is not None else None
+        for name, representative in representatives.items()
+    }
 
     # Once all are processed, write the full result to a JSON file.
-    with open(save_path, "w") as f:
-        json.dump(processed, f, indent=2)
+    if export_path:
+        with open(export_path, "w") as f:
+            json.dump(processed, f, indent=2)
         
     return processed
 
 
-def text_to_json(text: str, system_prompt: str, model="qwen2.5-coder:3b", **kwargs):
+def text_to_json(text: str, system_prompt: str, model="qwen2.5-coder:3b", cache: LLMCache = None, task: str = "text", **kwargs):
     """
     Convert a text to json
+    Valid answers are stored in `cache` when given
     kwargs are passed to ollama.chat option
     """
+    if cache is not None:
+        key = LLMCache.key(model, system_prompt, text, llm_options(kwargs))
+        result = cache.get(key, MISSING)
+        if result is not MISSING:
+            return result
 
+    result = None
     for attempt in range(5):
         try:
             result = query_ollama(
@@ -128,35 +468,117 @@ def text_to_json(text: str, system_prompt: str, model="qwen2.5-coder:3b", **kwar
 
             # Allow to make sure LLM returned a json output
             result = json.loads(result)
+            if cache is not None:
+                cache.put(key, task, system_prompt, result)
             break
-        except:
+        except Exception:
             pass
 
     return result
 
 
-def texts_to_json(texts: list[str], system_prompt: str, save_path: str, model="qwen2.5-coder:3b", use_cache=True, **kwargs):
+def texts_to_json(texts: list[str], system_prompt: str, save_path: str, model="qwen2.5-coder:3b", use_cache=True, concurrency: int = None, cache: LLMCache = None, task: str = "text", export_path: str = None, **kwargs):
     """
     Convert a list of texts to json with a caching mechanism
+    Answers are cached in `cache` under `task` (with `use_cache`), the
+    answers exported to `save_path` are imported the first time, and the
+    result is exported to `export_path` when given.
+    Up to `concurrency` texts are converted at the same time, the results
+    keep the order of `texts`
     kwargs are passed to ollama.chat option
     """
+    if not use_cache:
+        results = map_concurrently(
+            lambda text: text_to_json(text, system_prompt, model, **kwargs), texts, concurrency
+        )
+        processed = list(tqdm(results, total=len(texts), desc="Processing texts"))
+    else:
+        with llm_cache_context(cache) as cache:
+            options = llm_options(kwargs)
+            keys = [
+                (i, LLMCache.key(model, system_prompt, text, options))
+                for i, text in enumerate(texts)
+            ]
+            import_answers(cache, task, system_prompt, save_path, keys)
 
-    # Skip if already processed
-    if os.path.exists(save_path) and use_cache:
-        logging.info("Data has already been processed, loading it")
-        with open(save_path, "r") as f:
-            processed = json.load(f)
-        return processed
-
-    processed = []
-
-    for text in tqdm(texts, desc="Processing texts"):
-
-        processed.append(text_to_json(text, system_prompt, model, **kwargs))
-    
+            results = map_concurrently(
+                lambda text: text_to_json(text, system_prompt, model, cache=cache, task=task, **kwargs),
+                texts,
+                concurrency,
+            )
+            processed = list(tqdm(results, total=len(texts), desc="Processing texts"))
+            logging.info(f"LLM cache statistics: {cache.stats()}")
     
     # Once all are processed, write the full result to a JSON file.
-    with open(save_path, "w") as f:
-        json.dump(processed, f, indent=2)
+    if export_path:
+        with open(export_path, "w") as f:
+            json.dump(processed, f, indent=2)
 
     return processed
+
+
+def parse_json_answer(result: str):
+    """JSON value of an LLM answer, without its optional markdown formatting"""
+    if not isinstance(result, str):
+        return result
+    if "```json" in result:
+        result = result.replace("```json", "").lstrip()
+        result = result.replace("```", "").rstrip()
+    try:
+        return json.loads(result)
+    except json.JSONDecodeError:
+        return None
+
+
+class InfoboxConverter:
+    """
+    Convert infoboxes one at a time, for streaming builds.
+
+    It converts with rules first and shares the answers of
+    `infoboxes_to_json` through the LLM cache. The answers exported to
+    `save_path` are stored by name in the cache (see `import_exported`),
+    and looked up page by page (they are bound to the infobox texts), so
+    they are not held in memory.
+    """
+
+    def __init__(self, save_path: str, model="qwen2.5-coder:3b", cache: LLMCache = None, rules: bool = True, **kwargs):
+        self.save_path = save_path
+        self.model = model
+        self.rules = rules
+        self.kwargs = kwargs
+        self.options = llm_options(kwargs)
+        self.owns_cache = cache is None
+        self.cache = open_llm_cache() if cache is None else cache
+
+        self.cache.use_prompt("infobox", INFOBOX_SYSTEM_PROMPT)
+        self.cache.use_prompt(INFOBOX_TASKS[BATCH_SYSTEM_PROMPT], BATCH_SYSTEM_PROMPT)
+        import_exported(self.cache, "infobox", INFOBOX_SYSTEM_PROMPT, save_path)
+
+    def convert(self, name: str, infobox: str):
+        """JSON data of the infobox of page `name` (None if not valid JSON)"""
+        if not is_trivial(infobox):
+            # Bound even when the rules convert it, for the next builds
+            self.cache.bind_exported("infobox", [(name, infobox)])
+        data, unresolved = convert_with_rules(infobox, self.rules)
+        if unresolved == []:
+            return data
+
+        keys = infobox_keys(self.model, infobox, self.options)
+        result = self.cache.get_first(keys, MISSING)
+        if result is MISSING:
+            # Missing exported answers are converted again
+            result = self.cache.get_exported("infobox", name, self.model, infobox)
+        if result is MISSING or result is None:
+            result = query_with_retries(infobox, INFOBOX_SYSTEM_PROMPT, model=self.model, **self.kwargs)
+            if result is not None:
+                self.cache.put(keys[0], "infobox", INFOBOX_SYSTEM_PROMPT, result)
+
+        answer = parse_json_answer(result)
+        if unresolved is None:
+            return answer
+        return merge_answer(data, unresolved, answer)
+
+    def close(self):
+        logging.info(f"LLM cache statistics: {self.cache.stats()}")
+        if self.owns_cache:
+            self.cache.close()
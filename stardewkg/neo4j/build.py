@@ -0,0 +1,136 @@
+import logging
+import os
+
+from stardewkg.neo4j.writers.infobox import (
+    AnimalWriter,
+    ArtifactWriter,
+    BuildingWriter,
+    FishWriter,
+    FurnitureWriter,
+    InfoboxWriter,
+    LocationWriter,
+    MonsterWriter,
+    SeedWriter,
+    ToolWriter,
+    TreeWriter,
+    VillagerWriter,
+    WeaponWriter,
+)
+from stardewkg.utils.neo4j_async import AsyncWriter
+from stardewkg.utils.neo4j_batch import BatchWriter
+from stardewkg.utils.neo4j_export import CsvExporter
+from stardewkg.utils.neo4j_parallel import ParallelWriter
+from stardewkg.utils.neo4j_staging import StagingGraph
+from stardewkg.utils.neo4j_transaction import TransactionWriter
+from stardewkg.utils.neo4j_two_phase import TwoPhaseLoader
+from stardewkg.utils.neo4j_utils import create_schema, get_neo4j_driver, query_stats
+
+WRITE_MODES = ["batch", "transaction", "async", "parallel", "two_phase", "export"]
+# Modes holding the whole graph in memory
+STAGED_WRITE_MODES = ["two_phase", "export"]
+
+# Writer of the pages of each infobox type, the type is also the node label
+INFOBOX_TYPE_WRITERS = {
+    # Nodes fully handled by InfoboxWriter
+    "Clothing": InfoboxWriter,
+    "Mineral": InfoboxWriter,
+    "Cooking": InfoboxWriter,
+    # Nodes who need to have extended InfoboxWriter
+    "Villager": VillagerWriter,
+    "Location": LocationWriter,
+    "Fish": FishWriter,
+    "Monster": MonsterWriter,
+    "Furniture": FurnitureWriter,
+    "Animal": AnimalWriter,
+    "Tool": ToolWriter,
+    "Tree": TreeWriter,
+    "Building": BuildingWriter,
+    "Artifact": ArtifactWriter,
+    "Seed": SeedWriter,
+    "Weapon": WeaponWriter,
+}
+
+# Populated categories of pages without infobox type, written with a generic
+# InfoboxWriter
+INFOBOX_CATEGORIES = [
+    "Craftable items",
+    "Special items",
+    "Artisan Goods",
+    "Books",
+    "Resources",
+    "Animal Products",
+    "Decor",
+    "Craftable lighting",
+    "Fishing Tackle",
+    "Field Office donations",
+]
+
+
+def get_sink(write_mode: str, staged: bool = True):
+    """
+    Sink of the writers for `write_mode`, configured from the environment.
+
+    Writers target an in-memory staging graph (with `staged`), written once
+    at the end of the build, page by page. It is either buffered and sent as UNWIND
+    batches, run in explicit transactions, run concurrently with the asyncio
+    driver or a pool of threads, loaded in two phases (nodes, then
+    relationships by node id), or exported to CSV files for an offline
+    `neo4j-admin database import`.
+
+    Returns:
+        The sink and the neo4j driver (None when exporting)
+    """
+    if write_mode not in WRITE_MODES:
+        raise ValueError(f"Unknown NEO4J_WRITE_MODE {write_mode}")
+    if not staged and write_mode in STAGED_WRITE_MODES:
+        raise ValueError(f"NEO4J_WRITE_MODE {write_mode} needs the staged build")
+
+    if write_mode == "export":
+        return CsvExporter(os.getenv("EXPORT_FOLDER", "./data/import")), None
+
+    # Set up neo4j
+    driver = get_neo4j_driver()
+
+    # Indexes have to exist before the writers MERGE on them
+    logging.info("Creating schema")
+    create_schema(driver)
+
+    if write_mode == "two_phase":
+        sink = TwoPhaseLoader(
+            driver,
+            batch_size=int(os.getenv("NEO4J_BATCH_SIZE", 1000)),
+            workers=int(os.getenv("NEO4J_WORKERS", 8)),
+        )
+        return sink, driver
+
+    if write_mode == "batch":
+        target = BatchWriter(
+            driver, batch_size=int(os.getenv("NEO4J_BATCH_SIZE", 1000))
+        )
+    elif write_mode == "async":
+        target = AsyncWriter(concurrency=int(os.getenv("NEO4J_CONCURRENCY", 8)))
+    elif write_mode == "parallel":
+        target = ParallelWriter(driver, workers=int(os.getenv("NEO4J_WORKERS", 8)))
+    else:
+        target = TransactionWriter(
+            driver,
+            pages_per_transaction=int(os.getenv("NEO4J_PAGES_PER_TRANSACTION", 20)),
+        )
+    logging.info(f"Writing to neo4j with {type(target).__name__}")
+
+    if staged:
+        return StagingGraph(target), driver
+    return target, driver
+
+
+def infobox_page(writer, name: str, data: dict, **kwargs):
+    """Write job of the infobox data of a page"""
+    return lambda target: writer(target, name, data, **kwargs).write()
+
+
+def log_build_report():
+    """Log the write path statistics and write the build report"""
+    logging.info("Write path statistics (slowest first):\n" + query_stats.summary())
+    report_filepath = os.getenv("BUILD_REPORT", "logs/build_report.json")
+    query_stats.report(report_filepath)
+    logging.info(f"Build report written to {report_filepath}")
@@ -0,0 +1,175 @@
+import os
+from functools import partial
+from itertools import islice
+import dotenv
+from tqdm import tqdm
+from stardewkg.llm_json_formatter import InfoboxConverter
+from stardewkg.source_parser import SourceParser
+from stardewkg.parse_cache import ParseCache
+from stardewkg.utils.utils import category_to_neo4j
+from stardewkg.sources_loader import iter_parsed, load_sources
+from stardewkg.page_index import PageIndex
+from stardewkg.neo4j.writers.body import (
+    add_bundles,
+    add_gifting,
+    add_page_categories,
+    add_categories_structure,
+    page_categories,
+)
+from stardewkg.utils.neo4j_utils import query_stats
+from stardewkg.utils.neo4j_staging import StagingGraph, leaf_categories
+from stardewkg.neo4j.build import (
+    INFOBOX_CATEGORIES,
+    INFOBOX_TYPE_WRITERS,
+    get_sink,
+    infobox_page,
+    log_build_report,
+)
+from stardewkg.neo4j.writers.general import seed_reference_data
+import logging
+import sys
+from stardewkg.neo4j.writers.infobox import CropWriter, InfoboxWriter
+
+# python -m stardewkg.neo4j.run_streaming
+#
+# Same graph as run_writers, with a memory footprint which does not grow with
+# the corpus: pages flow through parse -> convert -> write and are written
+# directly to the database, in chunks. Only the page index and the category
+# structure (needed to select the crop and category pages) are kept, the
+# pages selected from them are streamed a second time (from the parse cache).
+# Page -> category edges are streamed like the rest of the page, only the
+# names of the categories holding pages are kept for `leaf_categories`.
+
+# Set up logging
+FORMAT = "%(asctime)s %(levelname)s %(message)s"
+filepath = "logs/run_streaming.log"
+logging.basicConfig(
+    handlers=[logging.FileHandler(filepath), logging.StreamHandler(sys.stdout)],
+    level=logging.INFO,
+    format=FORMAT,
+    datefmt="%Y-%m-%d %H:%M:%S",
+    encoding="utf-8",
+)
+logging.info(f"Logging to {filepath}")
+
+dotenv.load_dotenv()
+
+query_stats.enabled = True
+
+# No staging graph, export and two_phase modes are not available
+write_mode = os.getenv("NEO4J_WRITE_MODE", "batch")
+sink, driver = get_sink(write_mode, staged=False)
+
+logging.info("Seeding reference data")
+years = os.getenv("CALENDAR_YEARS")
+years = int(years) if years else None
+seed_reference_data(driver, years=years)
+
+# Pages parsed ahead of the writers, and pages per call to the sink
+queue_size = int(os.getenv("STREAM_QUEUE_SIZE", 64))
+chunk_size = int(os.getenv("STREAM_CHUNK_SIZE", 256))
+workers = int(os.getenv("PARSE_WORKERS", 0))
+
+converter = InfoboxConverter("./data/wiki/jsons/infoboxes_qwen2.5-coder:3b.json")
+
+# Global state
+index = PageIndex()
+# Category -> category edges, written at the end, and categories holding pages
+structure = StagingGraph()
+populated = set()
+
+typed_writers = {
+    infobox_type.lower(): (writer, infobox_type)
+    for infobox_type, writer in INFOBOX_TYPE_WRITERS.items()
+}
+
+
+def infobox_job(parsed, writer, **kwargs):
+    """Convert the infobox of a page, (name, write) job or None"""
+    data = converter.convert(parsed.title.replace("_", " "), parsed.infobox)
+    if data:
+        return (parsed.name, infobox_page(writer, parsed.name, data, **kwargs))
+    return None
+
+
+def page_jobs(parsed, filename: str):
+    """Index a page, return the jobs which only depend on the page itself"""
+    index.add(parsed.title, filename, parsed.infobox_type, parsed.categories)
+
+    populated.update(page_categories(parsed))
+    if "Category" in filename:
+        add_categories_structure(structure, parsed)
+
+    jobs = [(parsed.name, partial(add_page_categories, parsed=parsed))]
+    if parsed.infobox_type in typed_writers:
+        writer, infobox_type = typed_writers[parsed.infobox_type]
+        jobs.append(infobox_job(parsed, writer, labels=infobox_type))
+    if parsed.title == "Bundles":
+        jobs.append(("Bundles", partial(add_bundles, parsed=parsed)))
+    jobs.append((parsed.name, partial(add_gifting, parsed=parsed)))
+    return [job for job in jobs if job is not None]
+
+
+def write_chunks(jobs):
+    """Write a stream of jobs to the sink, `chunk_size` at a time"""
+    jobs = iter(jobs)
+    while chunk := list(islice(jobs, chunk_size)):
+        sink.write_pages(chunk)
+
+
+df = load_sources()
+
+with ParseCache(os.getenv("PARSE_CACHE", "./data/parse_cache.sqlite")) as cache:
+    logging.info("Streaming the pages")
+    pages = iter_parsed(df, SourceParser, workers, cache, queue_size)
+    write_chunks(
+        job
+        for parsed, filename in zip(tqdm(pages, total=len(df)), df["Filename"])
+        for job in page_jobs(parsed, filename)
+    )
+
+    logging.info("Adding category structure")
+    # Lets work on the crops.
+    # I need to remove the seeds because they are already added to the KG(known infoboxes)
+    leaves = leaf_categories(structure, "Crops", populated)
+    subcrops = set([leaf.replace("_", " ") for leaf in leaves if "seed" not in leaf])
+    structure.target = sink
+    structure.flush()
+    structure = populated = None
+
+    # Pages of the crop and populated categories, selected with the index
+    crops = index.any_category(subcrops)
+    unknown = index.infobox_type("unknown")
+    selections = [(crops, CropWriter, {})] + [
+        (
+            unknown & index.category(category),
+            InfoboxWriter,
+            {"labels": category_to_neo4j(category)},
+        )
+        for category in INFOBOX_CATEGORIES
+    ]
+    selected = 0
+    for bits, _, _ in selections:
+        selected |= bits
+
+    logging.info("Streaming the crop and category pages")
+    pages = iter_parsed(
+        df.loc[index.titles(selected)], SourceParser, workers, cache, queue_size
+    )
+    write_chunks(
+        job
+        for parsed in pages
+        for bits, writer, kwargs in selections
+        if bits >> index.ids[parsed.title] & 1
+        for job in [infobox_job(parsed, writer, **kwargs)]
+        if job is not None
+    )
+
+converter.close()
+
+sink.flush()
+sink.close()
+
+log_build_report()
+
+logging.info("Knowledge graph construction is done")
@@ -1,38 +1,32 @@
-import mwparserfromhell
 import os
+from functools import partial
 import dotenv
 from tqdm import tqdm
-from neo4j import Driver
 from stardewkg.llm_json_formatter import infoboxes_to_json
 from stardewkg.source_parser import SourceParser
+from stardewkg.parse_cache import ParseCache
 from stardewkg.utils.utils import category_to_neo4j, format_page_name
 from stardewkg.sources_loader import load_sources, parse_sources, add_categories
+from stardewkg.page_index import PageIndex
 from stardewkg.neo4j.writers.body import (
     add_bundles,
     add_gifting,
     add_page_categories,
     add_categories_structure,
 )
-from stardewkg.utils.neo4j_utils import get_neo4j_driver, make_query
-from stardewkg.neo4j.writers.general import create_dates
+from stardewkg.utils.neo4j_utils import query_stats
+from stardewkg.utils.neo4j_staging import leaf_categories
+from stardewkg.neo4j.build import (
+    INFOBOX_CATEGORIES,
+    INFOBOX_TYPE_WRITERS,
+    get_sink,
+    infobox_page,
+    log_build_report,
+)
+from stardewkg.neo4j.writers.general import seed_reference_data
 import logging
 import sys
-from stardewkg.neo4j.writers.infobox import (
-    AnimalWriter,
-    ArtifactWriter,
-    BuildingWriter,
-    CropWriter,
-    FishWriter,
-    FurnitureWriter,
-    InfoboxWriter,
-    LocationWriter,
-    MonsterWriter,
-    SeedWriter,
-    ToolWriter,
-    TreeWriter,
-    VillagerWriter,
-    WeaponWriter,
-)
+from stardewkg.neo4j.writers.infobox import CropWriter, InfoboxWriter
 
 # python -m stardewkg.neo4j.run_writers
 
@@ -48,65 +42,69 @@ logging.basicConfig(
 )
 logging.info(f"Logging to {filepath}")
 
-# Set up neo4j
 dotenv.load_dotenv()
-driver: Driver = get_neo4j_driver()
 
-# Part where I dont need any data (definitions)
-logging.info("Adding dates")
-create_dates(driver=driver)
+# Count queries, latency and database updates per writer, handler and
+# relationship type, reported at the end of the build
+query_stats.enabled = True
+
+write_mode = os.getenv("NEO4J_WRITE_MODE", "batch")
+sink, driver = get_sink(write_mode)
+
+# Part where I dont need any data (definitions), seeded in one transaction
+logging.info("Seeding reference data")
+years = os.getenv("CALENDAR_YEARS")
+years = int(years) if years else None
+seed_reference_data(sink if write_mode == "export" else driver, years=years)
 
 # Load data
 logging.info("Loading wikilinks files")
 df = load_sources()
 logging.info("Parsing the sources")
-parse_sources(df, SourceParser)
+# Pages are parsed by a pool of processes, all cores by default, unchanged
+# pages are read from the parse cache
+with ParseCache(os.getenv("PARSE_CACHE", "./data/parse_cache.sqlite")) as cache:
+    parse_sources(
+        df, SourceParser, workers=int(os.getenv("PARSE_WORKERS", 0)), cache=cache
+    )
 logging.info("Getting pages categories")
 add_categories(df)
 
+# Page selections below are set operations on the index postings
+index = PageIndex.from_dataframe(df)
+
 # Infobox part
 
-infoboxes = [(parsed.name, str(parsed.infobox)) for parsed in df["parsed"].values]
+# Keyed like the exported answers and the lookups below
+infoboxes = [
+    (parsed.title.replace("_", " "), str(parsed.infobox))
+    for parsed in df["parsed"].values
+]
 
 filepath = os.path.join("./data/wiki/jsons/infoboxes_qwen2.5-coder:3b.json")
 
 infoboxes = infoboxes_to_json(infoboxes=infoboxes, save_path=filepath)
 
 
-# Add nodes fully refactored by InfoboxWriter
-for infobox_type in ["Clothing", "Mineral", "Cooking"]:
-    logging.info(f"Adding nodes with label {infobox_type}")
-    pages = df.loc[df["infobox_type"] == infobox_type.lower()].index.tolist()
+def infobox_pages(pages: list[str], writer=InfoboxWriter, **kwargs) -> list:
+    """(name, write) jobs writing the infobox data of `pages` with `writer`"""
+    jobs = []
     for page in pages:
         name = format_page_name(page)
         data = infoboxes[page.replace("_", " ")]
         if data:
-            InfoboxWriter(driver, name, data, labels=infobox_type).write()
-
-# Add nodes who need to have extended InfoboxWriter
-infobox_type2writer = {
-    "Villager": VillagerWriter,
-    "Location": LocationWriter,
-    "Fish": FishWriter,
-    "Monster": MonsterWriter,
-    "Furniture": FurnitureWriter,
-    "Animal": AnimalWriter,
-    "Tool": ToolWriter,
-    "Tree": TreeWriter,
-    "Building": BuildingWriter,
-    "Artifact": ArtifactWriter,
-    "Seed": SeedWriter,
-    "Weapon": WeaponWriter,
-}
-
-for infobox_type, writer in infobox_type2writer.items():
+            jobs.append((name, infobox_page(writer, name, data, **kwargs)))
+    return jobs
+
+
+# Pages of the different infobox types are independent, they are written together
+jobs = []
+for infobox_type, writer in INFOBOX_TYPE_WRITERS.items():
     logging.info(f"Adding nodes with label {infobox_type}")
-    pages = df.loc[df["infobox_type"] == infobox_type.lower()].index.tolist()
-    for page in pages:
-        name = format_page_name(page)
-        data = infoboxes[page.replace("_", " ")]
-        if data:
-            writer(driver, name, data, labels=infobox_type).write()
+    pages = index.titles(index.infobox_type(infobox_type.lower()))
+    jobs += infobox_pages(pages, writer, labels=infobox_type)
+
+sink.write_pages(jobs)
 
 # Add infobox without type but with
 #   - an interesting category
@@ -114,100 +112,54 @@ for infobox_type, writer in infobox_type2writer.items():
 # I will be playing with categories so let's add them first to the KG
 
 logging.info("Adding page to category mapping")
-for parsed in tqdm(
-    df["parsed"].values, total=len(df), desc="page to category processing"
-):
-    add_page_categories(driver, parsed)
+sink.write_pages(
+    (parsed.name, partial(add_page_categories, parsed=parsed))
+    for parsed in tqdm(
+        df["parsed"].values, total=len(df), desc="page to category processing"
+    )
+)
 
 logging.info("Adding category structure")
-mask = df["Filename"].apply(lambda x: "Category" in x)
-for parsed in df.loc[mask, "parsed"].values:
-    add_categories_structure(driver, parsed)
+sink.write_pages(
+    (parsed.name, partial(add_categories_structure, category_parsed=parsed))
+    for parsed in df.loc[index.titles(index.category_pages), "parsed"].values
+)
 
 # Lets work on the crops.
 # I need to remove the seeds because they are already added to the KG(known infoboxes)
-query = """MATCH (top:Category {name: "Crops"})
-MATCH (leaf:Category)-[r:PART_OF*]->(top)
-WHERE NOT (leaf)<-[:PART_OF]-()
-RETURN DISTINCT leaf.name"""
-records, summary, keys = driver.execute_query(query)
-subcrops = set(
-    [
-        record.value().replace("_", " ")
-        for record in records
-        if "seed" not in record.value()
-    ]
-)
-subcrop_mask = df["categories"].apply(lambda x: bool(x & subcrops))
-crops = df.loc[subcrop_mask].index.to_list()
+leaves = leaf_categories(sink, "Crops")
+subcrops = set([leaf.replace("_", " ") for leaf in leaves if "seed" not in leaf])
+crops = index.titles(index.any_category(subcrops))
 
-for crop in crops:
-    name = format_page_name(crop)
-    data = infoboxes[crop.replace("_", " ")]
-    if data:
-        CropWriter(driver, name, data).write()
+sink.write_pages(infobox_pages(crops, CropWriter))
 
 
 # Now let's add populated categories with a generic InfoboxWriter
-categories = [
-    "Craftable items",
-    "Special items",
-    "Artisan Goods",
-    "Books",
-    "Resources",
-    "Animal Products",
-    "Decor",
-    "Craftable lighting",
-    "Fishing Tackle",
-    "Field Office donations",
-]
-
-for category in categories:
-    mask = df.apply(
-        lambda x: x["infobox_type"] == "unknown" and bool(x["categories"] & {category}),
-        axis=1,
-    )
-    pages = df.loc[mask].index.to_list()
-    for page in pages:
-        name = format_page_name(page)
-        data = infoboxes[page.replace("_", " ")]
-        if data:
-            InfoboxWriter(
-                driver, name, data, labels=category_to_neo4j(category)
-            ).write()
+jobs = []
+unknown = index.infobox_type("unknown")
+for category in INFOBOX_CATEGORIES:
+    pages = index.titles(unknown & index.category(category))
+    jobs += infobox_pages(pages, labels=category_to_neo4j(category))
+sink.write_pages(jobs)
 
 
 # Body part
 
 logging.info("Adding Bundles")
-add_bundles(driver, df.loc["Bundles", "parsed"])
+sink.write_pages(
+    [("Bundles", partial(add_bundles, parsed=df.loc["Bundles", "parsed"]))]
+)
 
 logging.info("Adding Giftings")
-for parsed in tqdm(df["parsed"].values, total=len(df)):
-    add_gifting(driver, parsed)
-
-
-# Cleaning up
-with driver.session() as session:
-    
-    # Remove duplicates (2 nodes)
-    query = """MATCH (n)
-    WITH n.name AS name, collect(n) AS nodes
-    WHERE size(nodes) > 1
-    WITH nodes[0] AS nodeToDelete
-    DETACH DELETE nodeToDelete"""
-    records, summary, keys = session.execute_query(driver, query)
-
-
-    # For each label, create a UNIQUE constraint on `name`
-    labels = make_query("CALL db.labels() YIELD label RETURN label").value()
-    for label in labels:
-        query = f"""
-        CREATE CONSTRAINT IF NOT EXISTS unique_{label}_name
-        FOR (n:`{label}`)
-        REQUIRE n.name IS UNIQUE;
-        """
-        session.execute_query(query)
+sink.write_pages(
+    (parsed.name, partial(add_gifting, parsed=parsed))
+    for parsed in tqdm(df["parsed"].values, total=len(df))
+)
+
+# The staging graph is deduplicated, no cleaning up needed once written
+sink.flush()
+sink.close()
 
+log_build_report()
 
 logging.info("Knowledge graph construction is done")
@@ -2,7 +2,7 @@ import logging
 import os
 from stardewkg.llm_json_formatter import texts_to_json
 
-from stardewkg.source_parser import SourceParser, get_tables, format_page_name
+from stardewkg.source_parser import ParsedPage, get_tables, format_page_name
 from stardewkg.utils.neo4j_utils import create_node_neo4j, create_relationship_neo4j
 from stardewkg.utils.utils import get_parenthesis
 from neo4j import Driver
@@ -36,7 +36,7 @@ def add_bundle(driver: Driver, bundle: dict):
         )
 
 
-def add_bundles(driver: Driver, parsed: SourceParser):
+def add_bundles(driver: Driver, parsed: ParsedPage):
     # Get bundle tables
     tables = get_tables(parsed.wikicode)
     tables = [str(table) for table in tables if 'Bundle" colspan="4"' in table]
@@ -85,7 +85,7 @@ def add_bundles(driver: Driver, parsed: SourceParser):
     filepath = os.path.join("./data/wiki/jsons/bundles_qwen2.5-coder:3b.json")
 
     bundles = texts_to_json(
-        texts=tables, system_prompt=system_prompt, save_path=filepath
+        texts=tables, system_prompt=system_prompt, save_path=filepath, task="bundles"
     )
 
     for bundle in bundles:
@@ -110,7 +110,7 @@ def parse_gifting(gifting_section: str):
     return res
 
 
-def add_gifting(driver: Driver, parsed: SourceParser):
+def add_gifting(driver: Driver, parsed: ParsedPage):
     if "Gifting" not in parsed.headings:
         return
 
@@ -138,25 +138,20 @@ def add_gifting(driver: Driver, parsed: SourceParser):
             )
 
 
-def add_page_categories(driver: Driver, parsed: SourceParser):
-    """Add the categories listed at the bottom of the page"""
+def page_categories(parsed: ParsedPage) -> list[str]:
+    """Categories listed at the bottom of the page"""
     if len(parsed.categories) == 0:
         # Handle artifacts edge case (no categories in source but visible in html)
-        if r"{{NavboxArtifacts}}" in str(parsed.wikicode):
+        if "NavboxArtifacts" in parsed.navboxes:
             # logging.debug(f"Fix category Artifcats for {parsed.name}")
-            create_relationship_neo4j(
-                driver,
-                from_node_name=parsed.name,
-                from_node_labels=None,
-                to_node_name="Artifacts",
-                to_node_labels="Category",
-                rel_type="PART_OF",
-            )
-        else:
-            # logging.debug(f"Page {parsed.name} does not have any category")
-            return
+            return ["Artifacts"]
+        # logging.debug(f"Page {parsed.name} does not have any category")
+    return parsed.categories
 
-    for category in parsed.categories:
+
+def add_page_categories(driver: Driver, parsed: ParsedPage):
+    """Add the categories listed at the bottom of the page"""
+    for category in page_categories(parsed):
         create_relationship_neo4j(
             driver,
             from_node_name=parsed.name,
@@ -167,7 +162,7 @@ def add_page_categories(driver: Driver, parsed: SourceParser):
         )
 
 
-def add_categories_structure(driver: Driver, category_parsed: SourceParser):
+def add_categories_structure(driver: Driver, category_parsed: ParsedPage):
     """Add the categories listed at the bottom of the page"""
 
     # Get the category name
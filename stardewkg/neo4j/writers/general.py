@@ -1,52 +1,117 @@
-from stardewkg.utils.neo4j_utils import create_relationship_neo4j
-from stardewkg.definitions import SEASONS
+from neo4j import ManagedTransaction
 
-def create_dates(driver):
+from stardewkg.utils.neo4j_batch import node_batch_query, relationship_batch_query
+from stardewkg.utils.neo4j_utils import (
+    GraphSink,
+    consume_query,
+    create_node_neo4j,
+    create_relationship_neo4j,
+)
+from stardewkg.utils.utils import format_page_name
+from stardewkg.definitions import SEASONS, SKILLS, VILLAGERS
+
+DAYS_PER_SEASON = 28
+
+
+def reference_data(years: int = None) -> tuple[dict, list]:
+    """
+    Generate the static reference data: the calendar and the anchor nodes
+    of `SKILLS`, `SEASONS` and `VILLAGERS`.
+
+    The calendar is cyclic: "Spring 1" ... "Winter 28" are PART_OF their
+    season, and days and seasons PRECEED/FOLLOW each other. With `years`,
+    dated days ("Spring 1, Year 2") are added, PART_OF their day and their
+    year, and chained from Year 1 to the last year.
+
+    Returns:
+        nodes (dict): label -> node names
+        relationships (list): (rel_type, from name, to name), all between Date nodes
+    """
+    days = [
+        f"{season} {day}"
+        for season in SEASONS
+        for day in range(1, DAYS_PER_SEASON + 1)
+    ]
+
+    nodes = {
+        "Date": SEASONS + days,
+        "Skill": SKILLS,
+        "Villager": [format_page_name(villager) for villager in VILLAGERS],
+    }
+    relationships = [("PART_OF", day, day.split(" ")[0]) for day in days]
+
+    # Seasons and dates cyclicity
+    for cycle in [SEASONS, days]:
+        for i in range(len(cycle)):
+            edge = (cycle[i], cycle[(i + 1) % len(cycle)])
+            relationships.append(("PRECEED", edge[0], edge[1]))
+            relationships.append(("FOLLOW", edge[1], edge[0]))
+
+    if years:
+        year_names = [f"Year {year}" for year in range(1, years + 1)]
+        dated_days = []
+        for year in year_names:
+            for day in days:
+                dated_days.append(f"{day}, {year}")
+                relationships.append(("PART_OF", dated_days[-1], day))
+                relationships.append(("PART_OF", dated_days[-1], year))
+        nodes["Date"] += year_names + dated_days
+
+        # Years and dated days are a timeline, not a cycle
+        for timeline in [year_names, dated_days]:
+            for edge in zip(timeline[:-1], timeline[1:]):
+                relationships.append(("PRECEED", edge[0], edge[1]))
+                relationships.append(("FOLLOW", edge[1], edge[0]))
+
+    return nodes, relationships
 
-    days_months = []
-    
-    # Date to season mapping
-    for season in SEASONS:
-        for day in range(1, 29):
-            days_months.append(f"{season} {day}")
-            create_relationship_neo4j(driver,
-                                    from_node_labels="Date",
-                                    from_node_name=days_months[-1],
-                                    to_node_labels="Date",
-                                    to_node_name=season,
-                                    rel_type="PART_OF")
-
-    # Season cyclicity
-    edges = [(SEASONS[i], SEASONS[(i + 1) % len(SEASONS)])
-            for i in range(len(SEASONS))]
-    for edge in edges:
-        create_relationship_neo4j(driver,
-                                from_node_labels="Date",
-                                from_node_name=edge[0],
-                                to_node_labels="Date",
-                                to_node_name=edge[1],
-                                rel_type="PRECEED")
-        create_relationship_neo4j(driver,
-                                from_node_labels="Date",
-                                from_node_name=edge[1],
-                                to_node_labels="Date",
-                                to_node_name=edge[0],
-                                rel_type="FOLLOW")
-
-    # Dates cyclicity
-    edges = [(days_months[i], days_months[(i + 1) % len(days_months)])
-            for i in range(len(days_months))]
-
-    for edge in edges:
-        create_relationship_neo4j(driver,
-                                from_node_labels="Date",
-                                from_node_name=edge[0],
-                                to_node_labels="Date",
-                                to_node_name=edge[1],
-                                rel_type="PRECEED")
-        create_relationship_neo4j(driver,
-                                from_node_labels="Date",
-                                from_node_name=edge[1],
-                                to_node_labels="Date",
-                                to_node_name=edge[0],
-                                rel_type="FOLLOW")
+
+def write_reference_data(tx: ManagedTransaction, nodes: dict, relationships: list):
+    for label, names in nodes.items():
+        rows = [{"name": name, "properties": {}} for name in names]
+        stats_key = ("general", "write_reference_data", None)
+        consume_query(tx, node_batch_query([label]), stats_key, rows=rows)
+
+    groups = {}
+    for rel_type, from_name, to_name in relationships:
+        groups.setdefault(rel_type, []).append(
+            {"from_node_name": from_name, "to_node_name": to_name, "properties": {}}
+        )
+    for rel_type, rows in groups.items():
+        query = relationship_batch_query(["Date"], ["Date"], rel_type)
+        stats_key = ("general", "write_reference_data", rel_type)
+        consume_query(tx, query, stats_key, rows=rows)
+
+
+def seed_reference_data(driver, years: int = None):
+    """
+    Write the reference data of `reference_data` (idempotent).
+
+    With a driver, everything is written in a single transaction, with one
+    UNWIND query per label and relationship type. A sink gets the usual
+    per-node and per-edge calls.
+    """
+    nodes, relationships = reference_data(years)
+
+    if isinstance(driver, GraphSink):
+        for label, names in nodes.items():
+            for name in names:
+                create_node_neo4j(driver, labels=label, name=name)
+        for rel_type, from_name, to_name in relationships:
+            create_relationship_neo4j(
+                driver,
+                from_node_labels="Date",
+                from_node_name=from_name,
+                to_node_labels="Date",
+                to_node_name=to_name,
+                rel_type=rel_type,
+            )
+        return
+
+    with driver.session() as session:
+        session.execute_write(write_reference_data, nodes, relationships)
+
+
+def create_dates(driver):
+    """Kept for compatibility, the calendar is part of the reference data"""
+    seed_reference_data(driver)
@@ -311,8 +311,8 @@ class InfoboxWriter:
                         handler(entity)
 
                 except CypherTypeError:
-                    print(self.name, key, entity)
-                    raise CypherTypeError
+                    logging.error(f"Failed to write {self.name} ({key}: {entity})")
+                    raise
             else:
                 # Store as a regular property
                 self.properties[key] = val
@@ -320,7 +320,9 @@ class InfoboxWriter:
         try:
             self._create_node(self.name, self.properties)
         except CypherTypeError:
-            print(self.name, key, entity)
+            # Re-raised so that a transaction scoped writer rolls back the page
+            logging.error(f"Failed to write {self.name} properties")
+            raise
         self._postprocess()
 
     def _create_node(self, name, properties):
@@ -0,0 +1,78 @@
+import pandas as pd
+
+
+class PageIndex:
+    """
+    Postings of the pages by infobox type and by category, built once after
+    parsing.
+
+    Page sets are integer bitsets (bit i is the i-th page of the DataFrame),
+    so selections are combined with `&` (AND), `|` (OR) and `negate` (NOT)
+    instead of scanning the DataFrame for every selector.
+
+    Usage:
+        index = PageIndex.from_dataframe(df)
+        pages = index.titles(index.infobox_type("unknown") & index.category("Books"))
+    """
+
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.all = 0
+        self._titles: list[str] = []
+
+        self.infobox_types: dict[str, int] = {}
+        self.categories: dict[str, int] = {}
+        # Pages of the Category namespace
+        self.category_pages = 0
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "PageIndex":
+        """Index a DataFrame with the "infobox_type" and "categories" columns"""
+        index = cls()
+        for title, filename, infobox_type, categories in zip(
+            df.index, df["Filename"], df["infobox_type"], df["categories"]
+        ):
+            index.add(title, filename, infobox_type, categories)
+        return index
+
+    def add(self, title: str, filename: str, infobox_type: str | None, categories):
+        """Index the next page"""
+        bit = 1 << len(self._titles)
+        self.ids[title] = len(self._titles)
+        self._titles.append(title)
+        self.all |= bit
+
+        if isinstance(infobox_type, str):
+            self.infobox_types[infobox_type] = self.infobox_type(infobox_type) | bit
+        for category in categories:
+            self.categories[category] = self.category(category) | bit
+        if "Category" in filename:
+            self.category_pages |= bit
+
+    def infobox_type(self, infobox_type: str) -> int:
+        return self.infobox_types.get(infobox_type, 0)
+
+    def category(self, category: str) -> int:
+        return self.categories.get(category, 0)
+
+    def any_category(self, categories) -> int:
+        """Pages in at least one of `categories`"""
+        bits = 0
+        for category in categories:
+            bits |= self.category(category)
+        return bits
+
+    def negate(self, bits: int) -> int:
+        return self.all & ~bits
+
+    def titles(self, bits: int) -> list[str]:
+        """Titles of a page set, in DataFrame order"""
+        res = []
+        while bits:
+            low = bits & -bits
+            res.append(self._titles[low.bit_length() - 1])
+            bits ^= low
+        return res
+
+    def count(self, bits: int) -> int:
+        return bits.bit_count()
@@ -0,0 +1,101 @@
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+
+from stardewkg.source_parser import PARSER_VERSION, ParsedPage, read_source
+
+
+class ParseCache:
+    """
+    On-disk cache of the `ParsedPage` records, in a sqlite file.
+
+    Records are keyed by a hash of the parser, `PARSER_VERSION`, the page
+    title and the content of the source file, so an edited page is parsed
+    again while unchanged pages skip mwparserfromhell. Records of other
+    parser versions are evicted when the cache is opened: bump
+    `PARSER_VERSION` when the parsing logic changes, or call `invalidate`.
+
+    Usage:
+        with ParseCache("./data/parse_cache.sqlite") as cache:
+            parse_sources(df, SourceParser, cache=cache)
+    """
+
+    def __init__(self, filepath: str, version: str = PARSER_VERSION):
+        self.filepath = filepath
+        self.version = str(version)
+        self.hits = 0
+        self.misses = 0
+
+        folder = os.path.dirname(filepath)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(filepath)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages "
+            "(key TEXT PRIMARY KEY, version TEXT, record BLOB)"
+        )
+        evicted = self.connection.execute(
+            "DELETE FROM pages WHERE version != ?", (self.version,)
+        ).rowcount
+        self.connection.commit()
+        if evicted:
+            logging.info(f"Evicted {evicted} pages parsed by other parser versions")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def key(self, title: str, filepath: str, parser, source: str = None) -> str:
+        """Key of a page, `source` is read from `filepath` when not given"""
+        if source is None:
+            source = read_source(filepath)
+        content = source.encode("utf-8")
+
+        h = hashlib.sha256()
+        for part in [parser.__module__, parser.__qualname__, self.version, title]:
+            h.update(part.encode())
+            h.update(b"\0")
+        h.update(content)
+        return h.hexdigest()
+
+    def get(self, key: str, filepath: str) -> ParsedPage | None:
+        row = self.connection.execute(
+            "SELECT record FROM pages WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        record = pickle.loads(row[0])
+        # Same content, possibly moved
+        record.filepath = filepath
+        return record
+
+    def put_many(self, items):
+        """Store (key, record) pairs"""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+            ((key, self.version, pickle.dumps(record)) for key, record in items),
+        )
+        self.connection.commit()
+
+    def invalidate(self):
+        """Drop every record"""
+        self.connection.execute("DELETE FROM pages")
+        self.connection.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        self.connection.close()
@@ -1,18 +1,23 @@
-from io import StringIO
 import os
 import re
 import dotenv
 from collections import defaultdict
+from functools import cached_property, lru_cache
+from typing import NamedTuple
 import mwparserfromhell
+from mwparserfromhell.nodes.heading import Heading
 from mwparserfromhell.nodes.template import Template
 from mwparserfromhell.nodes.tag import Tag
 from mwparserfromhell.wikicode import Wikicode
 import logging
 
 
-import pandas as pd
-
+from stardewkg.corpus import open_corpus, split_filepath
 from stardewkg.utils.utils import format_page_name
+from stardewkg.wikitable import read_wikitable  # noqa: F401
+
+# Number of full wikicode trees kept by `load_wikicode`
+WIKICODE_CACHE_SIZE = 32
 
 
 def extract_nested_templates(value):
@@ -28,16 +33,105 @@ def get_headings(wikicode: Wikicode):
 
 
 def get_heading_content(wikitext: str, heading: str) -> str:
-    parsed = mwparserfromhell.parse(wikitext)
-    sections = parsed.get_sections(include_lead=True)
+    return text_section_index(wikitext).content(wikitext, heading)
+
+
+class Section(NamedTuple):
+    title: str
+    level: int
+    # Offsets of the section (heading line included) in the source
+    start: int
+    end: int
+    # Titles of the direct subsections
+    subsections: tuple[str, ...]
+
+
+class SectionIndex:
+    """
+    Sections of a page by heading title, built in a single pass over the
+    top-level nodes of its wikicode.
+
+    Like `Wikicode.get_sections`, a section runs until the next heading of
+    the same or a higher level, so it contains its subsections. When
+    several headings share a title, the first one is indexed.
+    """
+
+    __slots__ = ("sections", "positions")
+
+    def __init__(self, sections: tuple[Section, ...]):
+        self.sections = sections
+        self.positions = {}
+        for i, section in enumerate(sections):
+            self.positions.setdefault(section.title, i)
+
+    @classmethod
+    def from_wikicode(cls, wikicode: Wikicode) -> "SectionIndex":
+        headings = []  # (title, level, start)
+        ends = []
+        children = []
+        stack = []  # open sections
+
+        offset = 0
+        for node in wikicode.nodes:
+            if isinstance(node, Heading):
+                while stack and headings[stack[-1]][1] >= node.level:
+                    ends[stack.pop()] = offset
+                if stack:
+                    children[stack[-1]].append(len(headings))
+                stack.append(len(headings))
+                headings.append((node.title.strip_code().strip(), node.level, offset))
+                ends.append(None)
+                children.append([])
+            offset += len(str(node))
+
+        for i in stack:
+            ends[i] = offset
+
+        return cls(
+            tuple(
+                Section(
+                    title,
+                    level,
+                    start,
+                    ends[i],
+                    tuple(headings[child][0] for child in children[i]),
+                )
+                for i, (title, level, start) in enumerate(headings)
+            )
+        )
 
-    for section in sections:
-        if not section.filter_headings():
-            continue
+    def __contains__(self, title: str) -> bool:
+        return title in self.positions
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
 
-        parsed_heading = section.filter_headings()[0].title.strip_code().strip()
-        if str(parsed_heading) == heading:
-            return "\n".join(section.splitlines()[1:])
+    def get(self, title: str) -> Section | None:
+        position = self.positions.get(title)
+        return self.sections[position] if position is not None else None
+
+    def content(self, source: str, title: str) -> str | None:
+        """Content of the section `title` in `source`, without its heading line"""
+        section = self.get(title)
+        if section is None:
+            return None
+        return "\n".join(source[section.start : section.end].splitlines()[1:])
+
+    def iter_contents(self, source: str):
+        """Yield the (section, content) of every section, in page order"""
+        for section in self.sections:
+            yield section, "\n".join(
+                source[section.start : section.end].splitlines()[1:]
+            )
+
+
+@lru_cache(maxsize=WIKICODE_CACHE_SIZE)
+def text_section_index(wikitext: str) -> SectionIndex:
+    """Section index of a wikitext, the last ones are cached"""
+    return SectionIndex.from_wikicode(mwparserfromhell.parse(wikitext))
 
 
 def get_tables(text) -> Tag:
@@ -72,11 +166,6 @@ def wiki_table_to_html(node: Tag):
     return "".join(result)
 
 
-def read_wikitable(table) -> pd.DataFrame:
-    html_text = wiki_table_to_html(table)
-    return pd.read_html(StringIO(html_text))[0]
-
-
 def extract_standalone_links(text):
     pattern = r"^\s*(\[\[.*?\]\])\s*$"
     links = re.findall(pattern, text, flags=re.MULTILINE)
@@ -84,25 +173,162 @@ def extract_standalone_links(text):
     return links
 
 
+# Standalone links (alone on their line, like the categories at the bottom of
+# a page, same pattern as `extract_standalone_links`) and navbox markers
+SOURCE_SCANNER = re.compile(
+    r"^\s*(?P<link>\[\[.*?\]\])\s*$|\{\{(?P<navbox>Navbox\w*)\}\}", re.MULTILINE
+)
+# A single plain link, the usual case
+SIMPLE_LINK = re.compile(r"\[\[(?P<title>[^\[\]{}|]*)(?:\|[^\[\]{}]*)?\]\]")
+
+
+class SourceScan(NamedTuple):
+    # Standalone links titles and the category ones, in page order
+    links: list[str]
+    categories: list[str]
+    # Names of the {{Navbox...}} markers
+    navboxes: set[str]
+
+
+def scan_source(source: str) -> SourceScan:
+    """
+    Extract the standalone links, categories and navbox markers of a raw
+    source in one pass, without building its wikicode.
+    """
+    links, categories, navboxes = [], [], set()
+    for match in SOURCE_SCANNER.finditer(source):
+        if match["navbox"]:
+            navboxes.add(match["navbox"])
+            continue
+
+        link = match["link"]
+        simple = SIMPLE_LINK.fullmatch(link)
+        if simple:
+            title = simple["title"]
+        else:
+            # Nested markup, the parser decides which link comes first
+            wikilink = mwparserfromhell.parse(link).filter_wikilinks()[0]
+            title, link = str(wikilink.title), str(wikilink)
+
+        links.append(title)
+        if "Category" in link:
+            categories.append(title.split(":")[-1])
+
+    return SourceScan(links, categories, navboxes)
+
+
+# Comments and wikitable delimiters, skipped, and single braces
+TEMPLATE_TOKENS = re.compile(
+    r"<!--.*?(?:-->|\Z)|^[ \t]*\{\||^[ \t]*\|\}(?!\})|\{|\}", re.MULTILINE | re.DOTALL
+)
+
+
+def template_spans(source: str):
+    """
+    Yield the (start, end) offsets of the top-level brace-balanced spans
+    ({{templates}}, {{{arguments}}}) of a source, without parsing it.
+    """
+    depth = 0
+    start = None
+    for match in TEMPLATE_TOKENS.finditer(source):
+        token = match.group()
+        if token == "{":
+            if depth == 0:
+                start = match.start()
+            depth += 1
+        elif token == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                yield start, match.end()
+
+
+def find_infobox(templates: list[Template]) -> Template | None:
+    # Check if there is an infobox
+    for template in templates:
+        if "Infobox" in template.name:
+            return template
+
+    return None
+
+
+# Bump when the parsing logic changes, to invalidate the parse cache
+PARSER_VERSION = 4
+
+
 class SourceParser:
-    def __init__(self, title: str, source: str = None):
+    """
+    Parse a wiki page source.
+
+    The attributes are computed on first access. With `lazy=False` they
+    are all computed upfront. In lazy mode, the infobox is extracted by
+    parsing only its template span (see `template_spans`), and the whole
+    page is parsed only when body-level attributes (wikicode, templates,
+    headings, sections) are used. Once it is parsed, the infobox is taken
+    from its tree.
+    """
+
+    def __init__(self, title: str, source: str = None, lazy: bool = False):
         self.title = title
         self.source = source
-
-        self.wikicode: Wikicode = mwparserfromhell.parse(
-            self.source, skip_style_tags=True
-        )
-        self.templates: list[Template] = self.wikicode.filter_templates()
-
-        # Infobox parsing
         self.name = format_page_name(self.title)
-        self.infobox = self.extract_infobox()
-        self.infobox_type = self.extract_infobox_type()
-        self.infobox_params = self.extract_infobox_params()
 
-        # Body parsing
-        self.headings = self.get_headings()
-        self.categories = self.get_categories()
+        if not lazy:
+            for attribute in SourceParser.ATTRIBUTES:
+                getattr(self, attribute)
+
+    # Cached attributes
+    ATTRIBUTES = [
+        "wikicode",
+        "templates",
+        "infobox",
+        "infobox_type",
+        "infobox_params",
+        "headings",
+        "sections",
+        "categories",
+    ]
+
+    @cached_property
+    def wikicode(self) -> Wikicode:
+        return mwparserfromhell.parse(self.source, skip_style_tags=True)
+
+    @cached_property
+    def templates(self) -> list[Template]:
+        return self.wikicode.filter_templates()
+
+    # Infobox parsing
+    @cached_property
+    def infobox(self) -> Template | None:
+        return self.extract_infobox()
+
+    @cached_property
+    def infobox_type(self) -> str:
+        return self.extract_infobox_type()
+
+    @cached_property
+    def infobox_params(self) -> dict:
+        return self.extract_infobox_params()
+
+    # Body parsing
+    @cached_property
+    def headings(self) -> list[str]:
+        return self.get_headings()
+
+    @cached_property
+    def sections(self) -> SectionIndex:
+        return SectionIndex.from_wikicode(self.wikicode)
+
+    @cached_property
+    def scan(self) -> SourceScan:
+        return scan_source(self.source or "")
+
+    @cached_property
+    def categories(self) -> list[str]:
+        return self.get_categories()
+
+    @property
+    def navboxes(self) -> set[str]:
+        return self.scan.navboxes
 
     def __str__(self):
         return f"SourceParser(infobox_type={self.infobox_type},infobox_param={self.infobox_params})"
@@ -113,12 +339,25 @@ class SourceParser:
         pass
 
     def extract_infobox(self) -> Template | None:
-        # Check if there is an infobox
-        for template in self.templates:
-            if "Infobox" in template.name:
-                return template
-
-        return None
+        if "wikicode" not in self.__dict__:
+            source = self.source or ""
+            # Only parse the top-level templates which may contain the infobox
+            for start, end in template_spans(source):
+                if "Infobox" in source[start:end]:
+                    span = mwparserfromhell.parse(
+                        source[start:end], skip_style_tags=True
+                    )
+                    infobox = find_infobox(span.filter_templates())
+                    if infobox is not None:
+                        return infobox
+
+            if "Infobox" not in source:
+                return None
+
+        # Fall back on the templates of the whole page, up to the infobox
+        if "templates" in self.__dict__:
+            return find_infobox(self.templates)
+        return find_infobox(self.wikicode.ifilter_templates())
 
     def extract_infobox_type(self) -> str:
         if not self.infobox:
@@ -178,24 +417,147 @@ class SourceParser:
             ]
 
     def get_heading_content(self, heading: str) -> str:
-        sections = self.wikicode.get_sections(include_lead=True)
+        return self.sections.content(self.source, heading)
 
-        for section in sections:
-            if not section.filter_headings():
-                continue
+    def get_categories(self) -> list[str]:
+        return list(dict.fromkeys(self.scan.categories))
 
-            parsed_heading = section.filter_headings()[0].title.strip_code().strip()
-            if str(parsed_heading) == heading:
-                return "\n".join(section.splitlines()[1:])
 
-    def get_categories(self) -> list[str]:
-        # links = parsed.wikicode.filter_wikilinks()
-        links = extract_standalone_links(str(self.wikicode))
+def plain_infobox_params(infobox_params: dict) -> dict:
+    """Infobox params with the nested templates as strings, so they can be pickled"""
+    if infobox_params is None:
+        return None
+
+    res = {}
+    for param_name, value in infobox_params.items():
+        if isinstance(value, dict):
+            value = {
+                key: (
+                    nested
+                    if isinstance(nested, str)
+                    else [str(nested[0]), [str(param) for param in nested[1]]]
+                )
+                for key, nested in value.items()
+            }
+        else:
+            value = str(value)
+        res[param_name] = value
+    return res
+
+
+def read_source(filepath: str) -> str:
+    """Read a source file, or a page of a zip or packed corpus"""
+    page = split_filepath(filepath)
+    if page is not None:
+        return open_corpus(page[0]).read(page[1])
+
+    with open(filepath, "r") as f:
+        return f.read()
+
+
+def iter_sources(filepaths: list[str]):
+    """
+    Yield the (position, source) of each of `filepaths`, read once: the
+    plain files in order, then the pages of each corpus in one sequential
+    pass over it (see `iter_pages`).
+    """
+    members = defaultdict(dict)  # corpus path -> member -> positions
+    for i, filepath in enumerate(filepaths):
+        page = split_filepath(filepath)
+        if page is None:
+            yield i, read_source(filepath)
+        else:
+            members[page[0]].setdefault(page[1], []).append(i)
+
+    for path, positions in members.items():
+        for member, source in open_corpus(path).iter_pages():
+            for i in positions.get(member, ()):
+                yield i, source
+
+
+@lru_cache(maxsize=WIKICODE_CACHE_SIZE)
+def load_wikicode(filepath: str) -> Wikicode:
+    """Parse the source at `filepath` again, the last trees are cached"""
+    return mwparserfromhell.parse(read_source(filepath), skip_style_tags=True)
+
+
+class ParsedPage:
+    """
+    Compact and picklable record of a parsed page, stored in the "parsed"
+    column by `parse_sources`.
+
+    Only the extracted fields and the section index are kept, not the
+    source nor the wikicode: they are read and parsed again from `filepath`
+    on demand, for the few consumers needing them (bundles, gifting,
+    category structure).
+    """
+
+    __slots__ = (
+        "title",
+        "name",
+        "filepath",
+        "infobox",
+        "infobox_type",
+        "infobox_params",
+        "headings",
+        "categories",
+        "navboxes",
+        "sections",
+    )
+
+    def __init__(
+        self,
+        title: str,
+        name: str,
+        filepath: str,
+        infobox: str | None,
+        infobox_type: str | None,
+        infobox_params: dict | None,
+        headings: tuple[str, ...],
+        categories: tuple[str, ...],
+        navboxes: frozenset[str],
+        sections: SectionIndex,
+    ):
+        self.title = title
+        self.name = name
+        self.filepath = filepath
+        self.infobox = infobox
+        self.infobox_type = infobox_type
+        self.infobox_params = infobox_params
+        self.headings = headings
+        self.categories = categories
+        self.navboxes = navboxes
+        self.sections = sections
+
+    @classmethod
+    def from_parser(cls, parser: SourceParser, filepath: str) -> "ParsedPage":
+        return cls(
+            title=parser.title,
+            name=parser.name,
+            filepath=filepath,
+            infobox=str(parser.infobox) if parser.infobox is not None else None,
+            infobox_type=parser.infobox_type,
+            infobox_params=plain_infobox_params(parser.infobox_params),
+            headings=tuple(parser.headings),
+            categories=tuple(parser.categories),
+            navboxes=frozenset(parser.navboxes),
+            sections=parser.sections,
+        )
 
-        res = []
-        for link in links:
-            title = link.title
-            if "Category" in link:
-                res.append(title.split(":")[-1])
+    def __repr__(self):
+        return f"ParsedPage(infobox_type={self.infobox_type},infobox_param={self.infobox_params})"
+
+    @property
+    def source(self) -> str:
+        return read_source(self.filepath)
+
+    @property
+    def wikicode(self) -> Wikicode:
+        return load_wikicode(self.filepath)
+
+    def get_heading_content(self, heading: str) -> str:
+        return self.sections.content(self.source, heading)
 
-        return list(set(res))
+    def iter_sections(self):
+        """Yield the (section, content) of every section, reading the source once"""
+        return self.sections.iter_contents(self.source)
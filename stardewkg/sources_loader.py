@@ -1,5 +1,5 @@
 from pathlib import Path
-import re
+import logging
 import pandas as pd
 import dotenv
 import os
@@ -7,52 +7,67 @@ import os
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
+    from stardewkg.parse_cache import ParseCache
     from stardewkg.source_parser import SourceParser
 
 
-from collections import defaultdict
-import mwparserfromhell
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import repeat
 
-
-def extract_standalone_links(text):
-    pattern = r"^\s*(\[\[.*?\]\])\s*$"
-    links = re.findall(pattern, text, flags=re.MULTILINE)
-    links = [mwparserfromhell.parse(link).filter_wikilinks()[0] for link in links]
-    return links
+from stardewkg.source_parser import (  # noqa: F401
+    ParsedPage,
+    extract_standalone_links,
+    iter_sources,
+    read_source,
+    scan_source,
+)
+from stardewkg.corpus import corpus_filepath, is_corpus, open_corpus
 
 
 def get_categories(parsed: "SourceParser"):
-    links = extract_standalone_links(str(parsed.wikicode))
-
-    res = []
-    for link in links:
-        title = link.title
-        if "Category" in link:
-            res.append(title.split(":")[-1])
-
-    return res
+    return scan_source(parsed.source).categories
 
 
 def load_sources() -> pd.DataFrame:
+    """
+    List the sources of DATA_FOLDER_WIKILINKS, a folder of `.txt` files, a
+    zip of them or a corpus packed by `stardewkg.corpus`. Pages of a zip or
+    a pack are read from it, nothing is extracted.
+    """
     dotenv.load_dotenv()
 
     data_folder = os.getenv("DATA_FOLDER_WIKILINKS")
 
-    folder_path = Path(data_folder)
-
     # Collect file details
     file_data = []
-    for f in folder_path.iterdir():
-        if f.is_file() and f.suffix.lower()==".txt":
-            file_data.append(
-                {
-                    "Filename": f.name,
-                    "Size (KB)": f.stat().st_size / 1024,
-                    "Created": f.stat().st_ctime,
-                    "Modified": f.stat().st_mtime,
-                    "Extension": f.suffix.lower(),
-                }
-            )
+    if is_corpus(data_folder):
+        for entry in open_corpus(data_folder).entries():
+            member = Path(entry["member"])
+            if member.suffix.lower() == ".txt":
+                file_data.append(
+                    {
+                        "Filename": member.name,
+                        "Size (KB)": entry["size"] / 1024,
+                        "Created": entry["mtime"],
+                        "Modified": entry["mtime"],
+                        "Extension": member.suffix.lower(),
+                        "Filepath": corpus_filepath(data_folder, entry["member"]),
+                    }
+                )
+    else:
+        for f in Path(data_folder).iterdir():
+            if f.is_file() and f.suffix.lower()==".txt":
+                file_data.append(
+                    {
+                        "Filename": f.name,
+                        "Size (KB)": f.stat().st_size / 1024,
+                        "Created": f.stat().st_ctime,
+                        "Modified": f.stat().st_mtime,
+                        "Extension": f.suffix.lower(),
+                        "Filepath": os.path.join(data_folder, f.name),
+                    }
+                )
 
     df = pd.DataFrame(file_data)
 
@@ -61,7 +76,6 @@ def load_sources() -> pd.DataFrame:
     df["Modified"] = pd.to_datetime(df["Modified"], unit="s")
 
     df["Title"] = df["Filename"].apply(lambda x: x.replace(".txt", "").capitalize())
-    df["Filepath"] = df["Filename"].apply(lambda x: os.path.join(data_folder, x))
 
     # Sort duplicates (caused by hyperlinks crawl, no prob)
     df.sort_values(by="Size (KB)", inplace=True, ascending=False)
@@ -72,23 +86,146 @@ def load_sources() -> pd.DataFrame:
 
 
 def parse_file(df_row, parser: "SourceParser"):
-    with open(df_row["Filepath"], "r") as f:
-        source = f.read()
+    source = read_source(df_row["Filepath"])
 
     return parser(df_row.name, source=source)
 
 
-def parse_sources(df: pd.DataFrame, parser: "SourceParser"):
-    df["parsed"] = df.apply(parse_file, args=[parser], axis=1)
+def parse_page(
+    title: str, filepath: str, parser: "SourceParser", source: str = None
+) -> ParsedPage:
+    """
+    Parse a page, return its compact `ParsedPage`. `source` is read from
+    `filepath` when not given.
+    """
+    if source is None:
+        source = read_source(filepath)
+
+    # Lazy, so the templates of the whole page are not filtered. The record
+    # needs the headings and sections of the whole page: it is parsed once,
+    # first, and the infobox is found in its tree rather than in a span
+    # parsed again
+    page = parser(title, source=source, lazy=True)
+    page.wikicode
+    return ParsedPage.from_parser(page, filepath)
+
+
+def parse_sources(
+    df: pd.DataFrame,
+    parser: "SourceParser",
+    workers: int = None,
+    cache: "ParseCache" = None,
+):
+    """
+    Parse the sources into the "parsed" column of compact `ParsedPage`.
+
+    With `workers`, pages are parsed by a pool of `workers` processes
+    (all cores if 0), otherwise in this process. With a `cache`, only the
+    pages missing from it are parsed, then stored. Each source is read once
+    (see `iter_sources`), for both its cache key and its parsing.
+    """
+    titles = list(df.index)
+    filepaths = list(df["Filepath"])
+    parsed = [None] * len(df)
+    keys = [None] * len(df)
+
+    # Sources of the pages to parse, by position
+    sources = {}
+    for i, source in iter_sources(filepaths):
+        if cache is not None:
+            keys[i] = cache.key(titles[i], filepaths[i], parser, source)
+            parsed[i] = cache.get(keys[i], filepaths[i])
+        if parsed[i] is None:
+            sources[i] = source
+
+    todo = sorted(sources)
+    todo_titles = [titles[i] for i in todo]
+    todo_filepaths = [filepaths[i] for i in todo]
+    todo_sources = [sources.pop(i) for i in todo]
+
+    if workers is None:
+        records = [
+            parse_page(title, filepath, parser, source)
+            for title, filepath, source in zip(todo_titles, todo_filepaths, todo_sources)
+        ]
+    else:
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            records = list(
+                executor.map(
+                    parse_page,
+                    todo_titles,
+                    todo_filepaths,
+                    repeat(parser),
+                    todo_sources,
+                    chunksize=max(1, len(todo) // (workers * 4)),
+                )
+            )
+
+    for i, record in zip(todo, records):
+        parsed[i] = record
+
+    if cache is not None:
+        cache.put_many((keys[i], parsed[i]) for i in todo)
+        logging.info(f"Parse cache: {cache.hits} hits, {cache.misses} misses")
+
+    df["parsed"] = parsed
     df.loc[:, "infobox_type"] = df["parsed"].apply(lambda x: x.infobox_type)
 
 
+def iter_parsed(
+    df: pd.DataFrame,
+    parser: "SourceParser",
+    workers: int = None,
+    cache: "ParseCache" = None,
+    queue_size: int = 64,
+):
+    """
+    Yield the `ParsedPage` of the sources of `df` in order, like
+    `parse_sources` but without keeping them: at most `queue_size` pages
+    are parsed ahead of the consumer. Sources are read one at a time, in
+    the order of `df`.
+    """
+    executor = None
+    if workers is not None:
+        executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+
+    # (cache key of a parsed page to store, page or future)
+    pending = deque()
+
+    def resolve(key, page):
+        if isinstance(page, Future):
+            page = page.result()
+        if key is not None:
+            cache.put_many([(key, page)])
+        return page
+
+    try:
+        for title, filepath in zip(df.index, df["Filepath"]):
+            # Read once, for both the cache key and the parsing
+            source = read_source(filepath)
+            key = page = None
+            if cache is not None:
+                key = cache.key(title, filepath, parser, source)
+                page = cache.get(key, filepath)
+            if page is not None:
+                key = None
+            elif executor is not None:
+                page = executor.submit(parse_page, title, filepath, parser, source)
+            else:
+                page = parse_page(title, filepath, parser, source)
+
+            pending.append((key, page))
+            if len(pending) >= queue_size:
+                yield resolve(*pending.popleft())
+
+        while pending:
+            yield resolve(*pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
 def add_categories(df: pd.DataFrame):
-    df["categories"] = [set() for _ in range(len(df))]
-    categories_count = defaultdict(int)
-
-    for index, parsed in dict(df["parsed"]).items():
-        categories = get_categories(parsed)
-        for category in categories:
-            categories_count[category] += 1
-            df.loc[index, "categories"].add(category)
+    # Categories are extracted from the raw sources by the parser
+    df["categories"] = [set(parsed.categories) for parsed in df["parsed"].values]
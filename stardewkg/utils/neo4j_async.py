@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+
+from neo4j import AsyncDriver, AsyncManagedTransaction
+from neo4j.exceptions import CypherTypeError
+
+from stardewkg.utils.neo4j_utils import (
+    GraphSink,
+    StatementRecorder,
+    get_async_neo4j_driver,
+    query_stats,
+)
+
+
+async def run_statements(
+    tx: AsyncManagedTransaction, statements: list[tuple[str, dict, tuple]]
+):
+    for query, params, stats_key in statements:
+        start = time.perf_counter()
+        result = await tx.run(query, **params)
+        summary = await result.consume()
+        query_stats.record_query(stats_key, time.perf_counter() - start, summary)
+
+
+class AsyncWriter(GraphSink):
+    """
+    Write pages concurrently with the asyncio neo4j driver.
+
+    The writers are unchanged: each page is first recorded with a
+    `StatementRecorder`, then its statements are run in one managed
+    transaction. At most `concurrency` transactions are in flight, and
+    transient errors (deadlocks) are retried by `execute_write`.
+
+    The asyncio driver is bound to its event loop: the writer runs its own
+    loop, and the driver is created by `driver_factory` on the first write,
+    then reused until `close`.
+
+    Usage:
+        AsyncWriter(concurrency=8).write_pages(
+            [(name, lambda target: InfoboxWriter(target, name, data).write())]
+        )
+    """
+
+    def __init__(
+        self, concurrency: int = 8, driver_factory=get_async_neo4j_driver
+    ):
+        self.concurrency = concurrency
+        self.driver_factory = driver_factory
+        self.loop = asyncio.new_event_loop()
+        self.driver: AsyncDriver = None
+
+        # Writes made outside of `write_pages`, run by `flush`
+        self.recorder = StatementRecorder()
+        self.failed_pages: list[str] = []
+
+    def merge_node(self, labels, name, properties):
+        self.recorder.merge_node(labels, name, properties)
+
+    def merge_relationship(
+        self,
+        from_node_name,
+        from_node_labels,
+        to_node_name,
+        to_node_labels,
+        rel_type,
+        properties,
+    ):
+        self.recorder.merge_relationship(
+            from_node_name,
+            from_node_labels,
+            to_node_name,
+            to_node_labels,
+            rel_type,
+            properties,
+        )
+
+    def write_pages(self, pages):
+        self.loop.run_until_complete(self._write_pages(list(pages)))
+
+    def flush(self):
+        statements = self.recorder.statements
+        if statements:
+            self.recorder = StatementRecorder()
+            # Run them as a single page
+            self.write_pages(
+                [(None, lambda target: target.statements.extend(statements))]
+            )
+
+    def close(self):
+        if self.driver is not None:
+            self.loop.run_until_complete(self.driver.close())
+            self.driver = None
+        self.loop.close()
+
+    async def _write_pages(self, pages):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        if self.driver is None:
+            self.driver = self.driver_factory()
+        await asyncio.gather(
+            *[
+                self._write_page(self.driver, semaphore, name, write)
+                for name, write in pages
+            ]
+        )
+
+    async def _write_page(
+        self, driver: AsyncDriver, semaphore: asyncio.Semaphore, name: str, write
+    ):
+        async with semaphore:
+            recorder = StatementRecorder()
+            write(recorder)
+            if not recorder.statements:
+                return
+
+            try:
+                async with driver.session() as session:
+                    await session.execute_write(run_statements, recorder.statements)
+            except CypherTypeError as e:
+                # The transaction of the page is rolled back
+                logging.error(f"Failed to write page {name}: {e}")
+                self.failed_pages.append(name)
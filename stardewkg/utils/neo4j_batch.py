@@ -0,0 +1,132 @@
+import logging
+
+from neo4j import Driver
+
+from stardewkg.utils.neo4j_utils import (
+    GraphSink,
+    PageBuffer,
+    check_properties,
+    consume_query,
+    merge_node_clause,
+    merge_relationship_clause,
+    query_stats,
+)
+
+
+def node_batch_query(labels: list[str]) -> str:
+    """UNWIND query merging a batch of nodes sharing the same labels"""
+    return f"""
+    UNWIND $rows AS row
+    {merge_node_clause("n", "row.name", labels)}
+    SET n += row.properties
+    """
+
+
+def relationship_batch_query(
+    from_node_labels: list[str], to_node_labels: list[str], rel_type: str
+) -> str:
+    """UNWIND query merging a batch of relationships sharing the same shape"""
+    return f"""
+    UNWIND $rows AS row
+    {merge_node_clause("a", "row.from_node_name", from_node_labels)}
+    {merge_node_clause("b", "row.to_node_name", to_node_labels)}
+    {merge_relationship_clause(rel_type, "row.properties")}
+    """
+
+
+class BatchWriter(PageBuffer, GraphSink):
+    """
+    Buffer node and relationship merges and write them in batches.
+
+    Operations are grouped by shape (node labels, or relationship type and
+    endpoints labels) and stats key, so that the latency of the batches is
+    attributed to their writer and handler. Each group is sent as one
+    parameterized `UNWIND $rows` query as soon as it holds `batch_size`
+    rows, the rest is sent by `flush`.
+
+    The merges of a page are checked and only buffered once it is written
+    (see `PageBuffer`), so an invalid page does not fail a later batch.
+
+    Usage:
+        with BatchWriter(driver) as batch:
+            InfoboxWriter(batch, name, data).write()
+    """
+
+    def __init__(self, driver: Driver, batch_size: int = 1000):
+        self.driver = driver
+        self.batch_size = batch_size
+
+        # Shape -> pending rows (dicts keep the insertion order of the shapes)
+        self.nodes: dict[tuple, list[dict]] = {}
+        self.relationships: dict[tuple, list[dict]] = {}
+
+        self.failed_pages: list[str] = []
+
+    def merge_node(self, labels, name, properties):
+        check_properties(properties)
+        self._apply(self._merge_node, (tuple(labels), query_stats.key()), name, properties)
+
+    def merge_relationship(
+        self,
+        from_node_name,
+        from_node_labels,
+        to_node_name,
+        to_node_labels,
+        rel_type,
+        properties,
+    ):
+        check_properties(properties)
+        shape = (
+            tuple(from_node_labels),
+            tuple(to_node_labels),
+            rel_type,
+            query_stats.key(rel_type),
+        )
+        self._apply(self._merge_relationship, shape, from_node_name, to_node_name, properties)
+
+    def _merge_node(self, shape, name, properties):
+        rows = self.nodes.setdefault(shape, [])
+        rows.append({"name": name, "properties": properties})
+
+        if len(rows) >= self.batch_size:
+            self._flush_nodes(shape)
+
+    def _merge_relationship(self, shape, from_node_name, to_node_name, properties):
+        rows = self.relationships.setdefault(shape, [])
+        rows.append(
+            {
+                "from_node_name": from_node_name,
+                "to_node_name": to_node_name,
+                "properties": properties,
+            }
+        )
+
+        if len(rows) >= self.batch_size:
+            self._flush_relationships(shape)
+
+    def flush(self):
+        """Write all pending operations, nodes first"""
+        for shape in list(self.nodes):
+            self._flush_nodes(shape)
+        for shape in list(self.relationships):
+            self._flush_relationships(shape)
+
+    def _flush_nodes(self, shape: tuple):
+        rows = self.nodes.pop(shape, None)
+        if rows:
+            labels, stats_key = shape
+            self._write(node_batch_query(list(labels)), rows, stats_key)
+
+    def _flush_relationships(self, shape: tuple):
+        rows = self.relationships.pop(shape, None)
+        if rows:
+            from_node_labels, to_node_labels, rel_type, stats_key = shape
+            query = relationship_batch_query(
+                list(from_node_labels), list(to_node_labels), rel_type
+            )
+            self._write(query, rows, stats_key)
+
+    def _write(self, query: str, rows: list[dict], stats_key: tuple = None):
+        logging.debug(f"Writing batch of {len(rows)} rows")
+        with self.driver.session() as session:
+            session.execute_write(consume_query, query, stats_key, rows=rows)
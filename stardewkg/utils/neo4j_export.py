@@ -0,0 +1,131 @@
+import csv
+import logging
+import os
+import time
+from collections import defaultdict
+
+from stardewkg.utils.neo4j_staging import StagingGraph
+from stardewkg.utils.neo4j_utils import BASE_LABEL, SCHEMA_QUERIES, property_type
+
+# Array delimiter (also used for the :LABEL column), the ASCII unit
+# separator which does not appear in the wiki text, unlike the default ";".
+# Passed to neo4j-admin as --array-delimiter=U+001F
+ARRAY_DELIMITER = "\x1f"
+
+
+def value_type(value) -> str | None:
+    """neo4j-admin type of a property value, None for null (no property)"""
+    if isinstance(value, list):
+        types = {property_type(v) for v in value}
+        field_type = types.pop() if len(types) == 1 else "string"
+        return f"{field_type}[]"
+    return property_type(value)
+
+
+def signature(properties: dict) -> tuple:
+    """(key, neo4j-admin type) of the non null properties, sorted by key"""
+    return tuple(
+        sorted(
+            (key, value_type(value))
+            for key, value in properties.items()
+            if value is not None
+        )
+    )
+
+
+def format_field(value, field_type: str) -> str:
+    if value is None:
+        return ""
+    if field_type.endswith("[]"):
+        value = value if isinstance(value, list) else [value]
+        fields = [format_field(v, field_type[:-2]) for v in value]
+        if any(ARRAY_DELIMITER in field for field in fields):
+            raise ValueError(f"Array element containing the array delimiter: {value}")
+        return ARRAY_DELIMITER.join(fields)
+    if field_type == "boolean":
+        return "true" if value else "false"
+    return str(value)
+
+
+class CsvExporter(StagingGraph):
+    """
+    Export the staged graph as `neo4j-admin database import` CSV files.
+
+    A CSV header types each column once, while a property can hold values of
+    different types on different nodes (a long `sellprice` on one item, a
+    list on another), so the nodes are written to one file per property
+    signature (see `signature`), and so are the relationships: the import
+    then stores every value with the type the Bolt writes give it.
+
+    `flush` writes the `nodes_<i>.csv` and `relationships_<i>.csv` files,
+    the `import.args` file listing them for `neo4j-admin` (run from the
+    export folder) and the `schema.cypher` to run once the database is
+    started.
+    """
+
+    def __init__(self, folder: str):
+        super().__init__()
+        self.folder = folder
+
+    def flush(self):
+        os.makedirs(self.folder, exist_ok=True)
+        files = self._write_nodes() + self._write_relationships()
+        with open(os.path.join(self.folder, "import.args"), "w") as f:
+            f.write("\n".join(files) + "\n")
+        with open(os.path.join(self.folder, "schema.cypher"), "w") as f:
+            f.write(";\n".join(SCHEMA_QUERIES) + ";\n")
+        logging.info(
+            f"Exported {len(self.nodes)} nodes and {len(self.relationships)} relationships "
+            f"to {len(files)} files in {self.folder}, "
+            f"{self.absorbed}/{self.writes} redundant writes absorbed"
+        )
+
+    def _write_nodes(self) -> list[str]:
+        """Write the node files, return their neo4j-admin arguments"""
+        groups = defaultdict(list)
+        for name, (labels, properties) in self.nodes.items():
+            # The name is the node id
+            properties = {key: value for key, value in properties.items() if key != "name"}
+            groups[signature(properties)].append((name, labels, properties))
+
+        arguments = []
+        for i, (columns, nodes) in enumerate(groups.items()):
+            filename = f"nodes_{i}.csv"
+            with open(os.path.join(self.folder, filename), "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(
+                    ["name:ID", ":LABEL"] + [f"{key}:{t}" for key, t in columns]
+                )
+                for name, labels, properties in nodes:
+                    labels = [BASE_LABEL] + sorted(labels - {BASE_LABEL})
+                    writer.writerow(
+                        [name, ARRAY_DELIMITER.join(labels)]
+                        + [format_field(properties[key], t) for key, t in columns]
+                    )
+            arguments.append(f"--nodes={filename}")
+        return arguments
+
+    def _write_relationships(self) -> list[str]:
+        """Write the relationship files, return their neo4j-admin arguments"""
+        created = int(time.time() * 1000)
+        groups = defaultdict(list)
+        for key, properties in self.relationships.items():
+            properties = {"created": created, **properties}
+            groups[signature(properties)].append((key, properties))
+
+        arguments = []
+        for i, (columns, relationships) in enumerate(groups.items()):
+            filename = f"relationships_{i}.csv"
+            with open(os.path.join(self.folder, filename), "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(
+                    [":START_ID", ":TYPE", ":END_ID"]
+                    + [f"{key}:{t}" for key, t in columns]
+                )
+                for (from_name, rel_type, to_name), properties in relationships:
+                    writer.writerow(
+                        [from_name, rel_type, to_name]
+                        + [format_field(properties[key], t) for key, t in columns]
+                    )
+            arguments.append(f"--relationships={filename}")
+        return arguments
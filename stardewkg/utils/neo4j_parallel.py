@@ -0,0 +1,166 @@
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from neo4j import Driver, ManagedTransaction
+from neo4j.exceptions import CypherTypeError
+
+from stardewkg.utils.neo4j_utils import (
+    BASE_LABEL,
+    GraphSink,
+    StatementRecorder,
+    consume_query,
+)
+
+
+def run_statements(tx: ManagedTransaction, statements: list[tuple[str, dict, tuple]]):
+    for query, params, stats_key in statements:
+        consume_query(tx, query, stats_key, **params)
+
+
+def touched_names(statements: list[tuple[str, dict, tuple]]) -> set[str]:
+    """Names of the nodes merged by `statements`"""
+    names = set()
+    for _, params, _ in statements:
+        for key in ["name", "from_node_name", "to_node_name"]:
+            if key in params:
+                names.add(params[key])
+    return names
+
+
+def partition_pages(
+    pages_names: list[set[str]], hub_threshold: int
+) -> tuple[list[list[int]], set[str]]:
+    """
+    Group pages whose writes touch the same nodes.
+
+    Nodes touched by more than `hub_threshold` pages (seasons, skills, big
+    locations...) would chain almost every page in a single group, so they
+    are returned apart as hubs and ignored by the grouping.
+
+    Args:
+        pages_names (list of set): Names of the nodes touched by each page.
+        hub_threshold (int): Maximum number of pages touching a non-hub node.
+
+    Returns:
+        Groups of page indices (largest first) and the hub names.
+    """
+    counts = Counter(name for names in pages_names for name in names)
+    hubs = {name for name, count in counts.items() if count > hub_threshold}
+
+    # Union-find over the pages, linked by the non hub nodes they share
+    parents = list(range(len(pages_names)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    owners = {}
+    for i, names in enumerate(pages_names):
+        for name in names - hubs:
+            if name in owners:
+                parents[find(i)] = find(owners[name])
+            else:
+                owners[name] = i
+
+    groups = {}
+    for i in range(len(pages_names)):
+        groups.setdefault(find(i), []).append(i)
+
+    return sorted(groups.values(), key=len, reverse=True), hubs
+
+
+class ParallelWriter(GraphSink):
+    """
+    Write pages concurrently on a pool of worker threads.
+
+    Each page is recorded with a `StatementRecorder`, then pages are
+    partitioned with `partition_pages` so that pages touching the same nodes
+    go to the same group, written sequentially by one worker. Hub nodes
+    shared by many pages are merged upfront, so that concurrent pages only
+    MERGE them as existing nodes (the Entity uniqueness constraint prevents
+    duplicates). The remaining lock contention on hubs can deadlock: every
+    page is a managed transaction, retried on transient errors by
+    `execute_write`.
+    """
+
+    def __init__(self, driver: Driver, workers: int = 8, hub_threshold: int = 16):
+        self.driver = driver
+        self.workers = workers
+        self.hub_threshold = hub_threshold
+
+        # Writes made outside of `write_pages`, run by `flush`
+        self.recorder = StatementRecorder()
+        self.failed_pages: list[str] = []
+
+    def merge_node(self, labels, name, properties):
+        self.recorder.merge_node(labels, name, properties)
+
+    def merge_relationship(
+        self,
+        from_node_name,
+        from_node_labels,
+        to_node_name,
+        to_node_labels,
+        rel_type,
+        properties,
+    ):
+        self.recorder.merge_relationship(
+            from_node_name,
+            from_node_labels,
+            to_node_name,
+            to_node_labels,
+            rel_type,
+            properties,
+        )
+
+    def write_pages(self, pages):
+        recorded = []
+        for name, write in pages:
+            recorder = StatementRecorder()
+            write(recorder)
+            if recorder.statements:
+                recorded.append((name, recorder.statements))
+
+        groups, hubs = partition_pages(
+            [touched_names(statements) for _, statements in recorded],
+            self.hub_threshold,
+        )
+        logging.debug(
+            f"Writing {len(recorded)} pages in {len(groups)} groups ({len(hubs)} hubs)"
+        )
+
+        if hubs:
+            with self.driver.session() as session:
+                session.execute_write(
+                    consume_query,
+                    f"UNWIND $names AS name MERGE (:{BASE_LABEL} {{name: name}})",
+                    ("ParallelWriter", "merge_hubs", None),
+                    names=list(hubs),
+                )
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self._write_group, [recorded[i] for i in group])
+                for group in groups
+            ]
+            for future in futures:
+                future.result()
+
+    def flush(self):
+        statements = self.recorder.statements
+        if statements:
+            self.recorder = StatementRecorder()
+            self._write_group([(None, statements)])
+
+    def _write_group(self, pages: list[tuple[str, list]]):
+        with self.driver.session() as session:
+            for name, statements in pages:
+                try:
+                    session.execute_write(run_statements, statements)
+                except CypherTypeError as e:
+                    # The transaction of the page is rolled back
+                    logging.error(f"Failed to write page {name}: {e}")
+                    self.failed_pages.append(name)
@@ -0,0 +1,209 @@
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+
+from stardewkg.utils.neo4j_utils import (
+    GraphSink,
+    PageBuffer,
+    check_properties,
+    create_node_neo4j,
+    create_relationship_neo4j,
+    node_properties,
+    query_stats,
+)
+
+
+class StagingGraph(PageBuffer, GraphSink):
+    """
+    In-memory graph the writers target before anything reaches the database.
+
+    Nodes are keyed by name (labels are merged and properties updated like
+    `SET n += $properties` would) and relationships by
+    (start name, type, end name), which mirrors the MERGE semantics of
+    `neo4j_utils`. `flush` writes the deduplicated graph once to the `target`
+    sink, one job per page, so that the sinks still commit, roll back and
+    partition pages. Each node and relationship belongs to the page which
+    first wrote it, and is replayed under the stats key of that write (see
+    `QueryStats.replay`). A page relationship to a node of another page
+    MERGEs its endpoint by name, which links both pages for the partitioning
+    of `ParallelWriter`, and a page rolled back at flush time only loses the
+    writes it made first.
+
+    The writes of a page are buffered and checked, see `PageBuffer`.
+    """
+
+    def __init__(self, target=None):
+        self.target = target
+
+        # name -> (labels, properties)
+        self.nodes: dict[str, tuple[set, dict]] = {}
+        # (from name, rel type, to name) -> properties
+        self.relationships: dict[tuple[str, str, str], dict] = {}
+        # node name or relationship key -> (page, stats key) of the first write
+        self.origins: dict = {}
+
+        # MERGEs (including relationship endpoints) and the redundant ones
+        self.writes = 0
+        self.absorbed = 0
+
+        self.current_page: str = None
+        self.failed_pages: list[str] = []
+
+    def merge_node(self, labels, name, properties):
+        properties = node_properties(properties)
+        check_properties(properties)
+        self._apply(
+            self._merge_node,
+            labels,
+            name,
+            properties,
+            (self.current_page, query_stats.key()),
+        )
+
+    def merge_relationship(
+        self,
+        from_node_name,
+        from_node_labels,
+        to_node_name,
+        to_node_labels,
+        rel_type,
+        properties,
+    ):
+        check_properties(properties)
+        self._apply(
+            self._merge_relationship,
+            from_node_name,
+            from_node_labels,
+            to_node_name,
+            to_node_labels,
+            rel_type,
+            properties,
+            (self.current_page, query_stats.key(rel_type)),
+        )
+
+    @contextmanager
+    def page(self, name: str = None):
+        self.current_page = name
+        try:
+            with super().page(name):
+                yield self
+        finally:
+            self.current_page = None
+
+    def flush(self):
+        """Write the staged graph to the target and empty it"""
+        logging.info(
+            f"Flushing {len(self.nodes)} nodes and {len(self.relationships)} relationships, "
+            f"{self.absorbed}/{self.writes} redundant writes absorbed"
+        )
+
+        # page -> (nodes, relationships), writes made outside of pages under None
+        pages = {}
+        for name, node in self.nodes.items():
+            page, stats_key = self.origins.get(name, (None, None))
+            pages.setdefault(page, ([], []))[0].append((name, node, stats_key))
+        for key, properties in self.relationships.items():
+            page, stats_key = self.origins.get(key, (None, None))
+            pages.setdefault(page, ([], []))[1].append((key, properties, stats_key))
+        self.nodes, self.relationships, self.origins = {}, {}, {}
+
+        self.target.write_pages(
+            (page, staged_page(nodes, relationships))
+            for page, (nodes, relationships) in pages.items()
+        )
+        self.target.flush()
+
+    def close(self):
+        if self.target is not None:
+            self.target.close()
+
+    def _merge_node(self, labels, name, properties, origin=(None, None)):
+        self.writes += 1
+        if name in self.nodes:
+            self.absorbed += 1
+        self.origins.setdefault(name, origin)
+        node_labels, node_properties = self.nodes.setdefault(name, (set(), {}))
+        node_labels.update(labels)
+        node_properties.update(properties)
+
+    def _merge_relationship(
+        self,
+        from_node_name,
+        from_node_labels,
+        to_node_name,
+        to_node_labels,
+        rel_type,
+        properties,
+        origin=(None, None),
+    ):
+        # Endpoints merged by the relationship query of a direct write
+        page, stats_key = origin
+        node_origin = (page, None if stats_key is None else (*stats_key[:2], None))
+        self._merge_node(from_node_labels, from_node_name, {}, node_origin)
+        self._merge_node(to_node_labels, to_node_name, {}, node_origin)
+
+        key = (from_node_name, rel_type, to_node_name)
+        self.writes += 1
+        if key in self.relationships:
+            self.absorbed += 1
+        self.origins.setdefault(key, origin)
+        self.relationships.setdefault(key, {}).update(properties)
+
+
+def staged_page(nodes: list, relationships: list):
+    """Write job of the staged nodes, then relationships, of a page"""
+
+    def write(target):
+        for name, (labels, properties), stats_key in nodes:
+            with query_stats.replay(stats_key):
+                create_node_neo4j(
+                    target, labels=sorted(labels), name=name, properties=properties
+                )
+        # Relationship endpoints already carry their labels
+        for (from_name, rel_type, to_name), properties, stats_key in relationships:
+            with query_stats.replay(stats_key):
+                create_relationship_neo4j(
+                    target,
+                    from_node_name=from_name,
+                    from_node_labels=None,
+                    to_node_name=to_name,
+                    to_node_labels=None,
+                    rel_type=rel_type,
+                    properties=properties,
+                )
+
+    return write
+
+
+def leaf_categories(graph: StagingGraph, top: str, populated: set = frozenset()) -> set[str]:
+    """
+    In-memory equivalent of the query used by the crop pass:
+    MATCH (leaf:Category)-[:PART_OF*]->(top:Category {name: top})
+    WHERE NOT (leaf)<-[:PART_OF]-()
+
+    `populated` holds the names of the nodes with PART_OF edges which are
+    not in `graph` (page -> category edges written to the database).
+    """
+    if "Category" not in graph.nodes.get(top, (set(), {}))[0]:
+        return set()
+
+    part_of = defaultdict(set)  # to -> from
+    for from_name, rel_type, to_name in graph.relationships:
+        if rel_type == "PART_OF":
+            part_of[to_name].add(from_name)
+
+    leaves = set()
+    seen = {top}
+    stack = [top]
+    while stack:
+        for child in part_of[stack.pop()]:
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+            if (
+                "Category" in graph.nodes[child][0]
+                and not part_of[child]
+                and child not in populated
+            ):
+                leaves.add(child)
+    return leaves
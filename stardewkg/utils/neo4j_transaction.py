@@ -0,0 +1,142 @@
+import logging
+from contextlib import contextmanager
+
+from neo4j import Driver
+from neo4j.exceptions import CypherTypeError
+
+from stardewkg.utils.neo4j_utils import (
+    GraphSink,
+    consume_query,
+    node_merge_query,
+    query_stats,
+    relationship_merge_query,
+)
+
+
+class TransactionWriter(GraphSink):
+    """
+    Run the writes of many pages in a single session and explicit transaction.
+
+    The writes of every page are scoped with `page()`. The transaction is
+    committed every `pages_per_transaction` pages, by `flush` and on exit.
+    A page failing with a `CypherTypeError` is rolled back atomically: the
+    transaction is rolled back and the pages already written in it are
+    replayed in a new one, so no half-written page is left behind.
+
+    Usage:
+        with TransactionWriter(driver, pages_per_transaction=50) as tx_writer:
+            for name, data in pages:
+                with tx_writer.page(name):
+                    InfoboxWriter(tx_writer, name, data).write()
+    """
+
+    def __init__(self, driver: Driver, pages_per_transaction: int = 1):
+        self.driver = driver
+        self.pages_per_transaction = pages_per_transaction
+
+        self.session = None
+        self.tx = None
+
+        # Statements of the open transaction, kept to replay it after a rollback
+        self.statements: list[tuple[str, dict, tuple]] = []
+        self.page_statements: list[tuple[str, dict, tuple]] | None = None
+        self.pages = 0
+        self.failed_pages: list[str] = []
+
+    def merge_node(self, labels, name, properties):
+        self._run(
+            node_merge_query(labels),
+            query_stats.key(),
+            name=name,
+            properties=properties,
+        )
+
+    def merge_relationship(
+        self,
+        from_node_name,
+        from_node_labels,
+        to_node_name,
+        to_node_labels,
+        rel_type,
+        properties,
+    ):
+        self._run(
+            relationship_merge_query(from_node_labels, to_node_labels, rel_type),
+            query_stats.key(rel_type),
+            from_node_name=from_node_name,
+            to_node_name=to_node_name,
+            properties=properties,
+        )
+
+    @contextmanager
+    def page(self, name: str = None):
+        self.page_statements = []
+        try:
+            yield self
+        except CypherTypeError as e:
+            logging.error(f"Rolling back page {name}: {e}")
+            self.failed_pages.append(name)
+            self._replay()
+        else:
+            self.statements.extend(self.page_statements)
+            self.pages += 1
+            if self.pages >= self.pages_per_transaction:
+                self.commit()
+        finally:
+            self.page_statements = None
+
+    def commit(self):
+        if self.tx is not None:
+            self.tx.commit()
+            self.tx.close()
+            self.tx = None
+        self.statements = []
+        self.pages = 0
+
+    def rollback(self):
+        if self.tx is not None:
+            self.tx.rollback()
+            self.tx.close()
+            self.tx = None
+
+    def flush(self):
+        self.commit()
+
+    def close(self):
+        self.rollback()
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            self.close()
+
+    def _begin(self):
+        if self.session is None:
+            self.session = self.driver.session()
+        self.tx = self.session.begin_transaction()
+
+    def _run(self, query: str, stats_key: tuple = None, **params):
+        if self.tx is None:
+            self._begin()
+
+        # Consume to surface errors within the page that caused them
+        consume_query(self.tx, query, stats_key, **params)
+
+        if self.page_statements is not None:
+            self.page_statements.append((query, params, stats_key))
+        else:
+            self.statements.append((query, params, stats_key))
+
+    def _replay(self):
+        """Roll back the transaction and rewrite its successful pages"""
+        self.rollback()
+        if not self.statements:
+            return
+
+        self._begin()
+        for query, params, stats_key in self.statements:
+            consume_query(self.tx, query, stats_key, **params)
@@ -0,0 +1,123 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from neo4j import Driver, ManagedTransaction
+
+from stardewkg.utils.neo4j_batch import node_batch_query
+from stardewkg.utils.neo4j_staging import StagingGraph
+from stardewkg.utils.neo4j_utils import (
+    consume_query,
+    merge_relationship_clause,
+    query_stats,
+)
+
+
+def relationship_by_id_batch_query(rel_type: str) -> str:
+    """UNWIND query merging relationships between nodes matched by elementId"""
+    return f"""
+    UNWIND $rows AS row
+    MATCH (a) WHERE elementId(a) = row.from_id
+    MATCH (b) WHERE elementId(b) = row.to_id
+    {merge_relationship_clause(rel_type, "row.properties")}
+    """
+
+
+def merge_nodes(
+    tx: ManagedTransaction, query: str, rows: list[dict]
+) -> dict[str, str]:
+    start = time.perf_counter()
+    result = tx.run(query, rows=rows)
+    ids = {record["name"]: record["id"] for record in result}
+    query_stats.record_query(
+        ("TwoPhaseLoader", "load_nodes", None),
+        time.perf_counter() - start,
+        result.consume(),
+    )
+    return ids
+
+
+def merge_relationships(
+    tx: ManagedTransaction, query: str, rows: list[dict], rel_type: str = None
+):
+    consume_query(tx, query, ("TwoPhaseLoader", "load_relationships", rel_type), rows=rows)
+
+
+class TwoPhaseLoader(StagingGraph):
+    """
+    Load the staged graph in two phases.
+
+    1. Every node (relationship endpoints included) is merged in UNWIND
+       batches, which return a name -> elementId map.
+    2. Relationships are merged between endpoints matched by elementId
+       only, instead of re-merging both endpoints by name for every edge.
+       The nodes all exist at this point, so the batches are written
+       concurrently by `workers` threads (deadlocks are retried by
+       `execute_write`).
+    """
+
+    def __init__(self, driver: Driver, batch_size: int = 1000, workers: int = 8):
+        super().__init__()
+        self.driver = driver
+        self.batch_size = batch_size
+        self.workers = workers
+
+    def flush(self):
+        logging.info(
+            f"Loading {len(self.nodes)} nodes and {len(self.relationships)} relationships, "
+            f"{self.absorbed}/{self.writes} redundant writes absorbed"
+        )
+        ids = self.load_nodes()
+        self.load_relationships(ids)
+        self.nodes, self.relationships, self.origins = {}, {}, {}
+
+    def load_nodes(self) -> dict[str, str]:
+        """Phase one: merge the nodes, return their elementId by name"""
+        groups = {}
+        for name, (labels, properties) in self.nodes.items():
+            groups.setdefault(tuple(sorted(labels)), []).append(
+                {"name": name, "properties": properties}
+            )
+
+        ids = {}
+        with self.driver.session() as session:
+            for labels, rows in groups.items():
+                query = node_batch_query(list(labels))
+                query += "RETURN row.name AS name, elementId(n) AS id"
+                for i in range(0, len(rows), self.batch_size):
+                    ids.update(
+                        session.execute_write(
+                            merge_nodes, query, rows[i : i + self.batch_size]
+                        )
+                    )
+        return ids
+
+    def load_relationships(self, ids: dict[str, str]):
+        """Phase two: merge the relationships between nodes matched by id"""
+        groups = {}
+        for (from_name, rel_type, to_name), properties in self.relationships.items():
+            groups.setdefault(rel_type, []).append(
+                {
+                    "from_id": ids[from_name],
+                    "to_id": ids[to_name],
+                    "properties": properties,
+                }
+            )
+
+        batches = [
+            (
+                relationship_by_id_batch_query(rel_type),
+                rows[i : i + self.batch_size],
+                rel_type,
+            )
+            for rel_type, rows in groups.items()
+            for i in range(0, len(rows), self.batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._write, *batch) for batch in batches]
+            for future in futures:
+                future.result()
+
+    def _write(self, query: str, rows: list[dict], rel_type: str):
+        with self.driver.session() as session:
+            session.execute_write(merge_relationships, query, rows, rel_type)
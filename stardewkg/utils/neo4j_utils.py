@@ -1,17 +1,474 @@
-from neo4j import Driver, GraphDatabase
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import logging
+import sys
+import threading
+import time
+from neo4j import AsyncDriver, AsyncGraphDatabase, Driver, GraphDatabase
+from neo4j.exceptions import CypherTypeError
 import dotenv
 import os
 
-def get_neo4j_driver() -> Driver:
+
+def get_neo4j_settings() -> tuple[str, tuple[str, str]]:
     uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
     username = os.getenv("NEO4J_USERNAME", "neo4j")
     password = os.getenv("NEO4J_PASSWORD", "password")
-    print(uri, username, password)
 
     if password is None:
         raise ValueError("NEO4J_PASSWORD must be set")
 
-    return GraphDatabase.driver(uri, auth=(username, password))
+    return uri, (username, password)
+
+
+def get_neo4j_driver() -> Driver:
+    uri, auth = get_neo4j_settings()
+    print(uri, *auth)
+
+    return GraphDatabase.driver(uri, auth=auth)
+
+
+def get_async_neo4j_driver() -> AsyncDriver:
+    """Same as `get_neo4j_driver` for the asyncio API"""
+    uri, auth = get_neo4j_settings()
+    return AsyncGraphDatabase.driver(uri, auth=auth)
+
+
+# Label shared by every node of the graph. Its `name` is unique (hence indexed)
+# and every MERGE anchors on it, so that node lookups are index seeks
+BASE_LABEL = "Entity"
+
+
+# The uniqueness constraint is backed by an index on `BASE_LABEL.name`
+SCHEMA_QUERIES = [
+    f"""CREATE CONSTRAINT unique_{BASE_LABEL.lower()}_name IF NOT EXISTS
+FOR (n:{BASE_LABEL})
+REQUIRE n.name IS UNIQUE"""
+]
+
+
+def create_schema(driver: Driver):
+    """Bootstrap the schema, to be run before any writer"""
+    for query in SCHEMA_QUERIES:
+        driver.execute_query(query)
+
+
+class GraphSink:
+    """
+    Base class for objects that can be used in place of a neo4j driver by the writers.
+
+    `create_node_neo4j` and `create_relationship_neo4j` hand their normalized
+    arguments to the sink instead of running a query, so any writer can target
+    a sink without changing its handler logic.
+    """
+
+    def merge_node(self, labels: list[str], name: str, properties: dict):
+        raise NotImplementedError
+
+    def merge_relationship(
+        self,
+        from_node_name: str,
+        from_node_labels: list[str],
+        to_node_name: str,
+        to_node_labels: list[str],
+        rel_type: str,
+        properties: dict,
+    ):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    @contextmanager
+    def page(self, name: str = None):
+        """Scope the writes of a single page (no-op unless the sink needs it)"""
+        yield self
+
+    def write_pages(self, pages):
+        """
+        Write `pages`, an iterable of (name, write) where `write(target)` writes
+        the page to the driver or sink it is given.
+        """
+        for name, write in pages:
+            with self.page(name):
+                write(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+
+def property_type(value) -> str | None:
+    """Type of a property value, None for null (no property)"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "long"
+    if isinstance(value, float):
+        return "double"
+    return "string"
+
+
+def check_property_value(value):
+    """Raise like the database would for a value that cannot be stored as a property"""
+    if isinstance(value, list):
+        if any(isinstance(v, (list, dict)) or v is None for v in value):
+            raise CypherTypeError(
+                f"Collections containing collections or nulls can not be stored in properties: {value}"
+            )
+        if len({property_type(v) for v in value}) > 1:
+            raise CypherTypeError(
+                f"Collections containing mixed types can not be stored in properties: {value}"
+            )
+    elif isinstance(value, dict):
+        raise CypherTypeError(
+            f"Property values can only be of primitive types or arrays thereof: {value}"
+        )
+
+
+def check_properties(properties: dict):
+    for value in properties.values():
+        check_property_value(value)
+
+
+class PageBuffer:
+    """
+    Mixin of the sinks buffering the writes of a page until it is written.
+
+    The sink checks the property values with `check_properties` and hands
+    its writes to `_apply`: inside `page()`, they are only applied once the
+    page is written, and a page failing with a `CypherTypeError` (property
+    values the database would reject) is logged and dropped, like a
+    transaction rollback, into `failed_pages`.
+    """
+
+    pending: list | None = None
+
+    @contextmanager
+    def page(self, name: str = None):
+        self.pending = []
+        try:
+            yield self
+        except CypherTypeError as e:
+            logging.error(f"Dropping page {name}: {e}")
+            self.failed_pages.append(name)
+        else:
+            for operation, args in self.pending:
+                operation(*args)
+        finally:
+            self.pending = None
+
+    def _apply(self, operation, *args):
+        if self.pending is not None:
+            self.pending.append((operation, args))
+        else:
+            operation(*args)
+
+
+# Counters of the result summaries kept by QueryStats
+COUNTERS = [
+    "nodes_created",
+    "relationships_created",
+    "properties_set",
+    "labels_added",
+]
+
+
+class QueryStats:
+    """
+    Instrumentation of the write path.
+
+    Rows are keyed by (writer, handler, rel_type). `record_operation` counts
+    the calls to `create_node_neo4j` / `create_relationship_neo4j`, attributed
+    to the calling writer class and handler (`_handle_source`,
+    `handle_recipe`, `add_gifting`...). `record_query` adds the latency and
+    the summary counters of every query run, by the same key for direct
+    driver calls, or by the sink running it.
+
+    Sinks replaying writes made earlier (the staging graph) run them under
+    `replay`: the queries are attributed to the writer and handler which
+    made the writes, and the operations are not counted again. The sinks
+    are also called under `replay` of the key `record_operation` resolved,
+    so the caller is only looked up once per operation.
+
+    Disabled by default, see `query_stats`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        # Key of the writes being replayed, per thread
+        self.replayed = threading.local()
+        self.rows = defaultdict(
+            lambda: {"operations": 0, "queries": 0, "latency": 0.0}
+            | {counter: 0 for counter in COUNTERS}
+        )
+
+    def caller(self) -> tuple[str, str]:
+        """(writer, handler) of the innermost code calling into this module or a sink"""
+        frame = sys._getframe(1)
+        while frame is not None and (
+            frame.f_globals.get("__name__") == __name__
+            or isinstance(frame.f_locals.get("self"), GraphSink)
+        ):
+            frame = frame.f_back
+        if frame is None:
+            return None, None
+
+        handler = frame.f_code.co_name
+        writer = frame.f_globals.get("__name__", "").split(".")[-1]
+
+        # The writer is the first object up the stack, unless the handler is
+        # a function run by a sink (a page job), then its module
+        while frame is not None:
+            owner = frame.f_locals.get("self")
+            if isinstance(owner, GraphSink):
+                break
+            if owner is not None:
+                writer = type(owner).__name__
+                break
+            frame = frame.f_back
+
+        return writer, handler
+
+    def key(self, rel_type: str = None) -> tuple:
+        """Key of the caller, or of the writes being replayed (None if disabled)"""
+        if not self.enabled:
+            return None
+        replayed = getattr(self.replayed, "key", None)
+        if replayed is not None:
+            return replayed
+        return (*self.caller(), rel_type)
+
+    def record_operation(self, rel_type: str = None) -> tuple:
+        """Count an operation of the caller, return its key (None if disabled)"""
+        key = self.key(rel_type)
+        if key is not None and getattr(self.replayed, "key", None) is None:
+            with self.lock:
+                self.rows[key]["operations"] += 1
+        return key
+
+    @contextmanager
+    def replay(self, key: tuple):
+        """Attribute the writes made inside to `key`, without counting them again"""
+        previous = getattr(self.replayed, "key", None)
+        self.replayed.key = key
+        try:
+            yield
+        finally:
+            self.replayed.key = previous
+
+    def record_query(self, key: tuple, latency: float, summary=None):
+        if not self.enabled or key is None:
+            return
+
+        with self.lock:
+            row = self.rows[key]
+            row["queries"] += 1
+            row["latency"] += latency
+            if summary is not None:
+                for counter in COUNTERS:
+                    row[counter] += getattr(summary.counters, counter)
+
+    def reset(self):
+        self.rows.clear()
+
+    def to_records(self) -> list[dict]:
+        """Rows sorted by latency, then number of operations"""
+        records = [
+            {"writer": writer, "handler": handler, "rel_type": rel_type, **row}
+            for (writer, handler, rel_type), row in self.rows.items()
+        ]
+        return sorted(
+            records, key=lambda r: (r["latency"], r["operations"]), reverse=True
+        )
+
+    def summary(self, limit: int = 30) -> str:
+        """Table of the `limit` slowest rows"""
+        columns = ["writer", "handler", "rel_type", "ops", "queries"]
+        columns += ["total ms", "mean ms", "nodes+", "rels+"]
+        widths = [20, 24, 18, 7, 7, 10, 8, 7, 7]
+
+        table = [columns]
+        for r in self.to_records()[:limit]:
+            mean = r["latency"] / r["queries"] if r["queries"] else 0
+            table.append(
+                [
+                    str(r["writer"])[:20],
+                    str(r["handler"])[:24],
+                    str(r["rel_type"] or "-")[:18],
+                    str(r["operations"]),
+                    str(r["queries"]),
+                    f"{r['latency'] * 1000:.1f}",
+                    f"{mean * 1000:.2f}",
+                    str(r["nodes_created"]),
+                    str(r["relationships_created"]),
+                ]
+            )
+
+        lines = [
+            " ".join(
+                f"{cell:<{width}}" if i < 3 else f"{cell:>{width}}"
+                for i, (cell, width) in enumerate(zip(row, widths))
+            )
+            for row in table
+        ]
+        lines.insert(1, "-" * len(lines[0]))
+        return "\n".join(lines)
+
+    def report(self, filepath: str):
+        """Write the rows and their totals to a JSON file"""
+        records = self.to_records()
+        totals = {
+            key: sum(r[key] for r in records)
+            for key in ["operations", "queries", "latency"] + COUNTERS
+        }
+        with open(filepath, "w") as f:
+            json.dump(
+                {"created": time.time(), "totals": totals, "rows": records},
+                f,
+                indent=2,
+            )
+
+
+query_stats = QueryStats()
+
+
+def to_labels(labels) -> list[str]:
+    """Normalize labels given as None, a string or a list to a list"""
+    if not labels:
+        return []
+    if isinstance(labels, str):
+        return [labels]
+    return list(labels)
+
+
+def set_labels_clause(var: str, labels: list[str]) -> str:
+    """Label-setting statement for node `var` (empty if there are no labels)"""
+    return f"SET {var}{''.join([':' + lbl for lbl in labels])}" if labels else ""
+
+
+def merge_node_clause(var: str, name: str, labels: list[str]) -> str:
+    """MERGE node `var` on the `name` expression and set its labels"""
+    return f"""MERGE ({var}:{BASE_LABEL} {{name: {name}}})
+    {set_labels_clause(var, labels)}"""
+
+
+def merge_relationship_clause(rel_type: str, properties: str) -> str:
+    """MERGE relationship `r` between already bound nodes `a` and `b`"""
+    return f"""MERGE (a)-[r:{rel_type}]->(b)
+    ON CREATE SET r.created = timestamp(), r += {properties}
+    ON MATCH  SET r.lastUpdated = timestamp(), r += {properties}"""
+
+
+def node_merge_query(labels: list[str]) -> str:
+    """Query merging a single node named $name"""
+    return f"""
+    {merge_node_clause("n", "$name", labels)}
+    SET n += $properties
+    RETURN n
+    """
+
+
+def relationship_merge_query(
+    from_node_labels: list[str], to_node_labels: list[str], rel_type: str
+) -> str:
+    """Query merging a single relationship between $from_node_name and $to_node_name"""
+    return f"""
+    {merge_node_clause("a", "$from_node_name", from_node_labels)}
+    {merge_node_clause("b", "$to_node_name", to_node_labels)}
+    {merge_relationship_clause(rel_type, "$properties")}
+    RETURN r
+    """
+
+
+def run_query(driver, query: str, stats_key: tuple = None, **params):
+    """
+    Run `query` on a driver (in a new session), a session or a transaction.
+    Its latency and summary are recorded under `stats_key`.
+    """
+    if isinstance(driver, Driver):
+        with driver.session() as session:
+            return run_query(session, query, stats_key, **params)
+
+    start = time.perf_counter()
+    result = driver.run(query, **params)
+    record = result.single()
+    query_stats.record_query(stats_key, time.perf_counter() - start, result.consume())
+    return record
+
+
+def consume_query(tx, query: str, stats_key: tuple = None, **params):
+    """
+    Run `query` on a session or a transaction and discard its records.
+    Its latency and summary are recorded under `stats_key`.
+    """
+    start = time.perf_counter()
+    summary = tx.run(query, **params).consume()
+    query_stats.record_query(stats_key, time.perf_counter() - start, summary)
+    return summary
+
+
+class StatementRecorder(GraphSink):
+    """
+    Record the (query, parameters, stats key) statements of the writers
+    instead of running them
+    """
+
+    def __init__(self):
+        self.statements: list[tuple[str, dict, tuple]] = []
+
+    def merge_node(self, labels, name, properties):
+        self.statements.append(
+            (
+                node_merge_query(labels),
+                {"name": name, "properties": properties},
+                query_stats.key(),
+            )
+        )
+
+    def merge_relationship(
+        self,
+        from_node_name,
+        from_node_labels,
+        to_node_name,
+        to_node_labels,
+        rel_type,
+        properties,
+    ):
+        self.statements.append(
+            (
+                relationship_merge_query(from_node_labels, to_node_labels, rel_type),
+                {
+                    "from_node_name": from_node_name,
+                    "to_node_name": to_node_name,
+                    "properties": properties,
+                },
+                query_stats.key(rel_type),
+            )
+        )
+
+
+def node_properties(properties: dict) -> dict:
+    """
+    Properties set on a node, without its merge key: a "name" property (the
+    infobox name, "Anchor" for the page "Anchor (furniture)") would rename
+    the node onto another entity, it is stored as "display_name".
+    """
+    if "name" not in properties:
+        return properties
+    properties = dict(properties)
+    properties["display_name"] = properties.pop("name")
+    return properties
 
 
 def create_node_neo4j(driver: Driver, labels: list[str], name: str, properties=None):
@@ -22,28 +479,28 @@ def create_node_neo4j(driver: Driver, labels: list[str], name: str, properties=N
     - If no labels are provided, the node is created/merged without labels.
 
     Args:
-        driver (neo4j.GraphDatabase.driver): The Neo4j driver instance.
+        driver (neo4j.GraphDatabase.driver, session, transaction or GraphSink): The Neo4j driver instance.
         labels (list or str or None): A single label as a string, multiple labels as a list, or None.
         name (str): The unique name of the node.
-        properties (dict, optional): Additional properties to set on the node.
+        properties (dict, optional): Additional properties to set on the node,
+            see `node_properties`.
     """
-    properties = properties or {}
-
-    if isinstance(labels, str):
-        labels = [labels]
+    properties = node_properties(properties or {})
+    labels = to_labels(labels)
+    stats_key = query_stats.record_operation()
 
-    # Prepare label-setting statements dynamically (only if labels exist)
-    set_labels = f"SET n{':'.join([':' + lbl for lbl in labels])}" if labels else ""
-
-    query = f"""
-    MERGE (n {{name: $name}})
-    {set_labels}
-    SET n += $properties
-    RETURN n
-    """
+    if isinstance(driver, GraphSink):
+        # The sink attributes the merge to the caller resolved above
+        with query_stats.replay(stats_key):
+            return driver.merge_node(labels, name, properties)
 
-    with driver.session() as session:
-        return session.run(query, name=name, properties=properties).single()
+    return run_query(
+        driver,
+        node_merge_query(labels),
+        stats_key,
+        name=name,
+        properties=properties,
+    )
 
 def create_relationship_neo4j(
     driver: Driver,
@@ -61,7 +518,7 @@ def create_relationship_neo4j(
     - If no labels are provided, nodes are created/merged without labels.
 
     Args:
-        driver (neo4j.GraphDatabase.driver): The Neo4j driver instance.
+        driver (neo4j.GraphDatabase.driver, session, transaction or GraphSink): The Neo4j driver instance.
         from_node_name (str): Unique name of the starting node.
         from_labels (list or None): Labels for the starting node (if any).
         to_node_name (str): Unique name of the ending node.
@@ -72,43 +529,31 @@ def create_relationship_neo4j(
     properties = properties or {}
 
     # Ensure labels are lists
-    if isinstance(from_node_labels, str):
-        from_node_labels = [from_node_labels]
-    if isinstance(to_node_labels, str):
-        to_node_labels = [to_node_labels]
-
-    # Prepare label-setting statements dynamically (only if labels exist)
-    set_from_labels = (
-        f"SET a{':'.join([':' + lbl for lbl in from_node_labels])}"
-        if from_node_labels
-        else ""
-    )
-    set_to_labels = (
-        f"SET b{':'.join([':' + lbl for lbl in to_node_labels])}"
-        if to_node_labels
-        else ""
-    )
+    from_node_labels = to_labels(from_node_labels)
+    to_node_labels = to_labels(to_node_labels)
+    stats_key = query_stats.record_operation(rel_type)
 
-    query = f"""
-    MERGE (a {{name: $from_node_name}})
-    {set_from_labels}
-    MERGE (b {{name: $to_node_name}})
-    {set_to_labels}
-    MERGE (a)-[r:{rel_type}]->(b)
-    ON CREATE SET r.created = timestamp(), r += $properties
-    ON MATCH  SET r.lastUpdated = timestamp(), r += $properties
-    RETURN r
-    """
+    if isinstance(driver, GraphSink):
+        # The sink attributes the merge to the caller resolved above
+        with query_stats.replay(stats_key):
+            return driver.merge_relationship(
+                from_node_name,
+                from_node_labels,
+                to_node_name,
+                to_node_labels,
+                rel_type,
+                properties,
+            )
 
-    with driver.session() as session:
-        return session.run(
-            query,
-            from_node_name=from_node_name,
-            to_node_name=to_node_name,
-            properties=properties,
-        ).single()
+    return run_query(
+        driver,
+        relationship_merge_query(from_node_labels, to_node_labels, rel_type),
+        stats_key,
+        from_node_name=from_node_name,
+        to_node_name=to_node_name,
+        properties=properties,
+    )
 
 
 def make_query(driver: Driver, query: str):
-    with driver.session() as session:
-        return session.run(query).single()
+    return run_query(driver, query)
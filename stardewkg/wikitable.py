@@ -0,0 +1,223 @@
+import re
+
+import mwparserfromhell
+import pandas as pd
+from mwparserfromhell.nodes import (
+    Argument,
+    Comment,
+    ExternalLink,
+    HTMLEntity,
+    Tag,
+    Template,
+    Text,
+    Wikilink,
+)
+from mwparserfromhell.wikicode import Wikicode
+
+# Tags rendered as a separator in the cell text
+BREAK_TAGS = {"br", "p", "li"}
+# Numbers with thousands separators, "1,000"
+THOUSANDS = re.compile(r"^-?\d{1,3}(?:,\d{3})+(?:\.\d+)?$")
+
+
+def template_text(template: Template, link_targets: bool = False) -> str:
+    """
+    Text of a template, following the conventions of the LLM prompts:
+    "{{Name|Parsnip}}" -> "Parsnip", "{{NPC|Sebastian|Half-Brother}}" ->
+    "Sebastian (Half-Brother)" and "{{!}}" -> "|". Named parameters are
+    dropped, see `wikicode_text` for `link_targets`.
+    """
+    name = str(template.name).strip()
+    if name == "!":
+        return "|"
+
+    values = [
+        wikicode_text(param.value, link_targets)
+        for param in template.params
+        if not param.showkey
+    ]
+    values = [value for value in values if value]
+    if not values:
+        return ""
+    if len(values) == 1:
+        return values[0]
+    return f"{values[0]} ({', '.join(values[1:])})"
+
+
+def wikicode_text(wikicode: Wikicode, link_targets: bool = False) -> str:
+    """
+    Plain text of a wikicode, with templates and links resolved. Links
+    render their text like a browser ("[[Melon|Melons]]" -> "Melons"), or
+    their target with `link_targets`, to name the linked entities.
+    """
+    parts = []
+    for node in wikicode.nodes:
+        if isinstance(node, Text):
+            parts.append(str(node))
+        elif isinstance(node, Wikilink):
+            if node.text is not None and not link_targets:
+                parts.append(wikicode_text(node.text))
+            else:
+                parts.append(str(node.title).strip())
+        elif isinstance(node, ExternalLink):
+            parts.append(str(node.title or node.url).strip())
+        elif isinstance(node, Template):
+            parts.append(template_text(node, link_targets))
+        elif isinstance(node, HTMLEntity):
+            parts.append(node.normalize())
+        elif isinstance(node, Tag):
+            if str(node.tag).lower() in BREAK_TAGS:
+                parts.append(" ")
+            if node.contents is not None:
+                parts.append(wikicode_text(node.contents, link_targets))
+        elif isinstance(node, (Comment, Argument)):
+            continue
+        else:
+            parts.append(str(node))
+    return " ".join("".join(parts).split())
+
+
+def cell_span(cell: Tag, name: str) -> int:
+    if not cell.has(name):
+        return 1
+    try:
+        return max(1, int(str(cell.get(name).value).strip()))
+    except ValueError:
+        return 1
+
+
+def table_rows(table: Tag) -> list[list[Tag]]:
+    """Cells of each row, the cells before the first "|-" make the first row"""
+    rows = [[]]
+    for node in table.contents.nodes:
+        if not isinstance(node, Tag):
+            continue
+        if node.tag == "td" and str(node.contents).startswith("+"):
+            # Caption ("|+"), not supported by the parser
+            continue
+        if node.tag in ["td", "th"]:
+            rows[0].append(node)
+        elif node.tag == "tr":
+            rows.append(
+                [
+                    cell
+                    for cell in node.contents.nodes
+                    if isinstance(cell, Tag) and cell.tag in ["td", "th"]
+                ]
+            )
+    return [row for row in rows if row]
+
+
+def wikitable_grid(table: Tag) -> tuple[list[list[str]], list[bool]]:
+    """
+    Expand the rowspan and colspan of a wikitable into a grid of cell texts.
+
+    Returns:
+        The rows of the grid, padded to the same width, and for each row
+        whether it only holds header cells.
+    """
+    grid = []
+    headers = []
+    # Column -> (remaining rows, text) of the cells spanning down
+    pending: dict[int, tuple[int, str]] = {}
+
+    for cells in table_rows(table):
+        row = []
+        column = 0
+
+        def fill_pending():
+            nonlocal column
+            while column in pending:
+                remaining, text = pending.pop(column)
+                row.append(text)
+                if remaining > 1:
+                    pending[column] = (remaining - 1, text)
+                column += 1
+
+        for cell in cells:
+            fill_pending()
+            text = wikicode_text(cell.contents)
+            rowspan = cell_span(cell, "rowspan")
+            for _ in range(cell_span(cell, "colspan")):
+                row.append(text)
+                if rowspan > 1:
+                    pending[column] = (rowspan - 1, text)
+                column += 1
+        fill_pending()
+        # Cells spanning down past the end of the row
+        for pending_column in sorted(c for c in pending if c >= column):
+            row.extend([None] * (pending_column - len(row)))
+            column = pending_column
+            fill_pending()
+
+        grid.append(row)
+        headers.append(all(cell.tag == "th" for cell in cells))
+
+    width = max((len(row) for row in grid), default=0)
+    return [row + [None] * (width - len(row)) for row in grid], headers
+
+
+def wikitable_columns(table: Tag) -> tuple[list, dict[int, list]]:
+    """
+    Walk a wikitable into columnar arrays.
+
+    Returns:
+        The column names (tuples when there are several header rows) and
+        the values of each column by position.
+    """
+    grid, headers = wikitable_grid(table)
+
+    n_headers = 0
+    while n_headers < len(grid) - 1 and headers[n_headers]:
+        n_headers += 1
+
+    width = len(grid[0]) if grid else 0
+    if n_headers == 0:
+        names = list(range(width))
+    elif n_headers == 1:
+        names = grid[0]
+    else:
+        names = list(zip(*grid[:n_headers]))
+
+    columns = {i: [] for i in range(width)}
+    for row in grid[n_headers:]:
+        for i, value in enumerate(row):
+            columns[i].append(value)
+    return names, columns
+
+
+def numeric(values: list) -> pd.Series:
+    """
+    Numbers when the whole column is numeric, thousands separators
+    included, like `pd.read_html`
+    """
+    series = pd.Series(values, dtype=object)
+    numbers = series.map(
+        lambda value: value.replace(",", "")
+        if isinstance(value, str) and THOUSANDS.match(value)
+        else value
+    )
+    try:
+        return pd.to_numeric(numbers)
+    except (ValueError, TypeError):
+        return series
+
+
+def read_wikitable(table: Tag) -> pd.DataFrame:
+    """DataFrame of a wikitable, see `wikitable_columns`"""
+    names, columns = wikitable_columns(table)
+    df = pd.DataFrame({i: numeric(values) for i, values in columns.items()})
+    if names and isinstance(names[0], tuple):
+        df.columns = pd.MultiIndex.from_tuples(names)
+    else:
+        df.columns = names
+    return df
+
+
+def read_wikitables(text: str) -> list[pd.DataFrame]:
+    """DataFrames of all the wikitables of a page"""
+    wikicode = mwparserfromhell.parse(text)
+    return [
+        read_wikitable(table)
+        for table in wikicode.filter_tags(matches=lambda node: node.tag == "table")
+    ]